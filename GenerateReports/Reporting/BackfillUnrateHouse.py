@@ -0,0 +1,75 @@
+import pandas as pd
+from Reporting import UnrateHouse
+
+# Backfill mode: rebuild the analysis as it looked on each of a range of historical dates
+# The lag regression and correlation grid come from one expanding pass over the data (see
+# UnrateHouse.expanding_ols_regression_lag / expanding_correlation_grid), the moving averages are
+# trailing so the full history sliced as of a date equals the moving averages of the truncated data.
+# The significance tests resample each date's whole history, so backfilled reports are written without them.
+BACKFILL_DIR = 'backfill/'
+# Dates with fewer rows are skipped: every moving average of the report and of the correlation grid needs a
+# full window, paired with every lag of the grid over at least CORR_MIN_PAIRS rows
+BACKFILL_MIN_ROWS = (max(max(UnrateHouse.MA_WINDOWS), max(UnrateHouse.CORR_GRID_WINDOWS))
+                     + max(UnrateHouse.CORR_GRID_LAGS) + UnrateHouse.CORR_MIN_PAIRS)
+
+# Function to list the as of dates of a backfill, e.g. freq='ME' for month ends
+def backfill_dates(start, end, freq='ME'):
+    return list(pd.date_range(start, end, freq=freq))
+
+# Function to build one analysis per as of date, with the same keys as UnrateHouse.run_analysis
+# Dates with fewer than BACKFILL_MIN_ROWS rows of data are left out of the result, rolling=False leaves out
+# the rolling regression
+def build_backfill_analyses(dir, dates, nlag=24, col='house_diff', jobs=1, rolling=True):
+    master = UnrateHouse.process_raw_data(dir)
+    positions = UnrateHouse.as_of_positions(master.index, dates)
+    skipped = [as_of for as_of, rows in zip(dates, positions) if rows < max(BACKFILL_MIN_ROWS, nlag + 2)]
+    if skipped:
+        print('Backfill skips ' + str(len(skipped)) + ' date(s) up to ' + str(skipped[-1].date())
+              + ' with fewer than ' + str(max(BACKFILL_MIN_ROWS, nlag + 2)) + ' rows of data')
+    dates = [as_of for as_of in dates if as_of not in skipped]
+    ma_master = UnrateHouse.add_moving_averages(master)
+    regressions = UnrateHouse.expanding_ols_regression_lag(master, nlag, col, dates)
+    grids = UnrateHouse.expanding_correlation_grid(master, dates, col=col)
+    # Rolling windows only look back, the windows ending by a date are the rolling regression as of that date
+    rolling_regression = UnrateHouse.rolling_ols_regression_lag(master, nlag, col) if rolling else None
+
+    # ADF tests are not incremental, they run once per date on the pool and are memoized by data hash
+    masters = {as_of: master.loc[:as_of] for as_of in dates}
+    columns = UnrateHouse.STATIONARY_COLUMNS
+    results = UnrateHouse.adf_tests([masters[as_of][column].dropna().to_numpy(dtype=float)
+                                     for as_of in dates for column in columns],
+                                    jobs, dir + UnrateHouse.CACHE_DIR)
+
+    analyses = {}
+    for k, as_of in enumerate(dates):
+        date_results = results[k * len(columns):(k + 1) * len(columns)]
+        analyses[as_of] = UnrateHouse.build_analysis(
+            masters[as_of], nlag, col,
+            stationary_result=UnrateHouse.stationary_result_frame(date_results, columns,
+                                                                  UnrateHouse.STATIONARY_DESCRIPTIONS),
+            regression_result=regressions[as_of],
+            rolling_regression=({name: paths.loc[:as_of] for name, paths in rolling_regression.items()}
+                                if rolling else None),
+            ma_master=ma_master.loc[:as_of], grid=grids[as_of])
+    return analyses
+
+# Function to summarize how the lag conclusion evolved over the backfilled dates
+def backfill_summary(analyses, nlag=24):
+    summary = []
+    for as_of, analysis in analyses.items():
+        regression_result = analysis['regression_result']
+        grid = analysis['correlation_grid']
+        added_lags = regression_result.iloc[1:].dropna()
+        summary.append({
+            'Date': as_of.date(),
+            'Rows': len(analysis['master']),
+            'R2 ' + str(nlag) + ' Lags': regression_result['R2'].iloc[-1],
+            'Largest Change in R2 Lag': (int(added_lags.loc[added_lags['Change in R2'].idxmax(), 'Total Lag'])
+                                         if len(added_lags) else None),
+            'Best MA Window': grid['best_window'],
+            'Best Lag': grid['best_lag'],
+            'Best Correlation': grid['best_corr'],
+            'Best Lag ' + str(UnrateHouse.AFTER_MA_WINDOW) + 'MA':
+                grid['best_lag_by_window'].get(UnrateHouse.AFTER_MA_WINDOW),
+        })
+    return pd.DataFrame(summary)
@@ -0,0 +1,94 @@
+import os
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from Reporting import UnrateHouse
+
+# Batch mode: run the unemployment / house price analysis for many series pairs (e.g. one per state or metro)
+# The pairs come from a manifest csv with columns name, unemployment, house (paths relative to the manifest),
+# or from a directory holding one sub folder per pair with its own UNRATE.csv and MSPNHSUS.csv
+MANIFEST_FILE = 'batch_manifest.csv'
+BATCH_DIR = 'batch/'
+
+# Function to list the (name, unemployment csv, house price csv) pairs of a batch
+def find_pairs(source):
+    if os.path.isfile(source):
+        manifest = pd.read_csv(source)
+        base = os.path.dirname(os.path.abspath(source))
+        return [(str(row['name']), os.path.join(base, row['unemployment']), os.path.join(base, row['house']))
+                for _, row in manifest.iterrows()]
+
+    pairs = []
+    for name in sorted(os.listdir(source)):
+        folder = os.path.join(source, name)
+        unrate_path = os.path.join(folder, 'UNRATE.csv')
+        house_path = os.path.join(folder, 'MSPNHSUS.csv')
+        if os.path.isfile(unrate_path) and os.path.isfile(house_path):
+            pairs.append((name, unrate_path, house_path))
+    return pairs
+
+# Function to run stationary test, lag regression and MA correlations for one pair and write its artifacts
+def analyze_pair(name, unrate_path, house_path, output_dir, nlag=24, col='house_diff'):
+    master = UnrateHouse.build_master(UnrateHouse.read_fred_csv(unrate_path, 'UNRATE'),
+                                      UnrateHouse.read_fred_csv(house_path, 'MSPNHSUS'))
+    stationary_result = UnrateHouse.stationary_test(master)
+    regression_result = UnrateHouse.ols_regression_lag(master, nlag, col)
+    ma_master = UnrateHouse.add_moving_averages(master)
+    ma_columns = ['house_diff'] + ['house_' + str(window) + 'MA' for window in UnrateHouse.MA_WINDOWS]
+    ma_corr = ma_master[ma_columns].corrwith(ma_master['UNRATE']).rename('Correlation with UNRATE')
+
+    pair_dir = output_dir + name + '/'
+    os.makedirs(pair_dir, exist_ok=True)
+    stationary_result[['Description', 'P-Value', 'Result']].to_csv(pair_dir + 'stationary_result.csv', index=False)
+    regression_result.to_csv(pair_dir + 'regression_result.csv', index=False)
+    ma_corr.to_csv(pair_dir + 'ma_correlation.csv', index_label='Column')
+
+    summary = {'Name': name, 'Rows': len(master),
+               'Start': master.index[0].date(), 'End': master.index[-1].date()}
+    for column, p_value in zip(UnrateHouse.MASTER_COLUMNS, stationary_result['P-Value']):
+        summary['ADF P-Value ' + column] = p_value
+    summary['R2 ' + str(nlag) + ' Lags'] = regression_result['R2'].iloc[-1]
+    # The first lag's change is its whole R2, so the largest gain is searched from the second lag on
+    added_lags = regression_result.iloc[1:] if len(regression_result) > 1 else regression_result
+    summary['Largest Change in R2 Lag'] = int(added_lags.loc[added_lags['Change in R2'].idxmax(), 'Total Lag'])
+    for column, corr in ma_corr.items():
+        summary['Corr ' + column] = corr
+    summary['Strongest MA'] = ma_corr.abs().idxmax()
+    return summary
+
+# Function to analyze one pair without stopping the batch, a failing pair (e.g. a malformed or too short file)
+# is reported in the Error column of the summary
+def analyze_pair_or_error(name, unrate_path, house_path, output_dir, nlag=24):
+    try:
+        return analyze_pair(name, unrate_path, house_path, output_dir, nlag)
+    except Exception as error:
+        return {'Name': name, 'Error': repr(error)}
+
+# Function to run the batch on a process pool and write one summary table plus per-pair artifacts
+def run_batch(source, dir, jobs=1, nlag=24, report_name='unemployment_house_batch_summary.csv'):
+    pairs = find_pairs(source)
+    output_dir = dir + BATCH_DIR
+    os.makedirs(output_dir, exist_ok=True)
+
+    if jobs <= 1:
+        summary = [analyze_pair_or_error(name, unrate_path, house_path, output_dir, nlag)
+                   for name, unrate_path, house_path in pairs]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(analyze_pair_or_error, name, unrate_path, house_path, output_dir, nlag)
+                       for name, unrate_path, house_path in pairs]
+            summary = []
+            for (name, unrate_path, house_path), future in zip(pairs, futures):
+                # A worker that dies (e.g. out of memory) fails its future instead of returning the error
+                try:
+                    summary.append(future.result())
+                except Exception as error:
+                    summary.append({'Name': name, 'Error': repr(error)})
+
+    summary_df = pd.DataFrame(summary)
+    if 'Error' not in summary_df:
+        summary_df['Error'] = None
+    summary_df = summary_df[[column for column in summary_df.columns if column != 'Error'] + ['Error']]
+    summary_df.to_csv(dir + report_name, index=False)
+    failed = int(summary_df['Error'].notna().sum())
+    print(f"Batch summary of {len(summary_df)} pairs ({failed} failed) saved to {dir + report_name}")
+    return summary_df
@@ -0,0 +1,170 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from Reporting import UnrateHouse
+
+# Incremental mode: FRED appends one row a month, so the state of the previous run is kept next to the inputs
+# and only the new rows are folded into it. The state holds the master frame with its moving averages, the
+# running sums of the lag regression normal equations and the correlation sums of every (MA window x lag)
+# pair. When a row that was already seen changes (a revision) or the settings differ, it is rebuilt from scratch.
+# The rolling regression is kept per window once a report asked for it: windows only look back, so only the
+# windows ending at new rows are solved. The ADF tests have no running form, they rerun on the full history
+# and are memoized by data hash (UnrateHouse.adf_tests). The significance tests resample the whole history,
+# so incremental runs skip them and the reports are written without them.
+STATE_FILE = 'incremental.npz'
+CORR_SUMS = 6
+
+# Function to start an empty state for the given settings
+def empty_state(settings):
+    nlag = settings['nlag']
+    return {
+        'master': pd.DataFrame({col: np.array([], dtype=settings['dtype']) for col in UnrateHouse.MASTER_COLUMNS},
+                               index=pd.DatetimeIndex([], name='DATE')),
+        'ma': np.zeros((0, len(settings['ma_windows']))),
+        'xtx': np.zeros((nlag + 1, nlag + 1)),
+        'xty': np.zeros(nlag + 1),
+        'yty': np.zeros(()),
+        'head_xtx': np.zeros((nlag + 1, nlag + 1, nlag + 1)),
+        'head_xty': np.zeros((nlag + 1, nlag + 1)),
+        'head_yty': np.zeros(nlag + 1),
+        'corr_sums': np.zeros((CORR_SUMS, len(settings['lags']), len(settings['windows']))),
+        'rolling_R2': np.zeros((0, nlag)),
+        'rolling_coefficients': np.zeros((0, nlag + 1)),
+        'settings': settings,
+    }
+
+# Function to load the state of the previous run, returns None when there is none or it used other settings
+def load_state(dir, settings):
+    state_path = dir + UnrateHouse.CACHE_DIR + STATE_FILE
+    if not os.path.exists(state_path):
+        return None
+    with np.load(state_path, allow_pickle=False) as cache:
+        if json.loads(str(cache['settings'])) != settings:
+            return None
+        state = {name: cache[name] for name in cache.files if name not in ('settings', 'DATE')}
+        state['master'] = pd.DataFrame({col: state.pop(col) for col in UnrateHouse.MASTER_COLUMNS},
+                                       index=pd.DatetimeIndex(cache['DATE'], name='DATE'))
+    state['settings'] = settings
+    return state
+
+# Function to write the state as plain numpy arrays
+def save_state(dir, state):
+    os.makedirs(dir + UnrateHouse.CACHE_DIR, exist_ok=True)
+    master = state['master']
+    arrays = {name: value for name, value in state.items() if name not in ('master', 'settings')}
+    arrays.update({col: master[col].to_numpy() for col in UnrateHouse.MASTER_COLUMNS})
+    with open(dir + UnrateHouse.CACHE_DIR + STATE_FILE, 'wb') as file:
+        np.savez(file, DATE=master.index.to_numpy(), settings=np.array(json.dumps(state['settings'])), **arrays)
+
+# Function to check that master only appends rows to the master of the state
+def is_append(state, master):
+    old = state['master']
+    if len(master) < len(old) or not master.index[:len(old)].equals(old.index):
+        return False
+    return all(np.array_equal(master[col].to_numpy()[:len(old)], old[col].to_numpy(), equal_nan=True)
+               for col in UnrateHouse.MASTER_COLUMNS)
+
+# Function to fold the rows of master after the rows of the state into the state
+# Only the trailing rows the new rows depend on are read: nlag rows for the lag matrix, and the largest
+# window plus the largest lag for the moving averages paired with the new unemployment rates
+def append_rows(state, master):
+    settings = state['settings']
+    nlag, col = settings['nlag'], settings['col']
+    windows, lags, ma_windows = settings['windows'], settings['lags'], settings['ma_windows']
+    start, end = len(state['master']), len(master)
+    y = master['UNRATE'].to_numpy(dtype=float)
+
+    # Lag regression normal equations, the first nlag + 1 rows also record the head sums
+    lo = max(0, start - nlag)
+    x = np.nan_to_num(UnrateHouse.lag_matrix(master.iloc[lo:end], nlag, col))[start - lo:]
+    xtx, xty, yty = state['xtx'], state['xty'], float(state['yty'])
+    for row in range(start, min(end, nlag + 1)):
+        state['head_xtx'][row] = xtx
+        state['head_xty'][row] = xty
+        state['head_yty'][row] = yty
+        xtx = xtx + np.outer(x[row - start], x[row - start])
+        xty = xty + x[row - start] * y[row]
+        yty = yty + y[row] ** 2
+    bulk = max(start, min(end, nlag + 1))
+    xtx = xtx + x[bulk - start:].T @ x[bulk - start:]
+    xty = xty + x[bulk - start:].T @ y[bulk:end]
+    yty = yty + y[bulk:end] @ y[bulk:end]
+    state['xtx'], state['xty'], state['yty'] = xtx, xty, np.array(yty)
+
+    # Correlation sums of the pairs whose unemployment rate is a new row
+    tail = max(0, start - max(lags) - max(windows) + 1)
+    ma, valid = UnrateHouse.correlation_inputs(UnrateHouse.moving_average_matrix(master[col].to_numpy()[tail:end],
+                                                                                 windows))
+    y_tail = y[tail:end]
+    for j, lag in enumerate(lags):
+        if lag >= len(y_tail):
+            continue
+        first = max(0, start - tail - lag)
+        state['corr_sums'][:, j] += UnrateHouse.lag_correlation_sums(ma, valid, y_tail, lag, first)
+
+    # Moving average columns of the report
+    ma_tail = max(0, start - max(ma_windows) + 1)
+    new_ma = UnrateHouse.moving_average_matrix(master['house_diff'].to_numpy()[ma_tail:end], ma_windows)
+    state['ma'] = np.concatenate([state['ma'], new_ma[start - ma_tail:]])
+    state['master'] = master
+    return state
+
+# Function to solve the rolling regression windows of master that the state does not hold yet
+# Window k of the rolling regression reads the rows from k * step on, so the next window is the first window
+# of master from row (windows done) * step
+def extend_rolling(state, master):
+    settings = state['settings']
+    step = settings['rolling_step']
+    rolling = UnrateHouse.rolling_ols_regression_lag(master.iloc[len(state['rolling_R2']) * step:],
+                                                     settings['nlag'], settings['col'], settings['rolling_window'],
+                                                     step)
+    state['rolling_R2'] = np.concatenate([state['rolling_R2'], rolling['R2'].to_numpy()])
+    state['rolling_coefficients'] = np.concatenate([state['rolling_coefficients'],
+                                                    rolling['coefficients'].to_numpy()])
+    return state
+
+# Function to build the rolling regression of UnrateHouse.rolling_ols_regression_lag from the state
+def rolling_regression(state, master):
+    settings = state['settings']
+    nlag, col, step = settings['nlag'], settings['col'], settings['rolling_step']
+    index = master.index[nlag + settings['rolling_window'] - 1 + step * np.arange(len(state['rolling_R2']))]
+    return {
+        'R2': pd.DataFrame(state['rolling_R2'], index=index,
+                           columns=pd.Index(np.arange(1, nlag + 1), name='Total Lag')),
+        'coefficients': pd.DataFrame(state['rolling_coefficients'], index=index,
+                                     columns=[col] + ['lag_' + str(k) for k in range(1, nlag + 1)]),
+    }
+
+# Function to build the analysis of UnrateHouse.run_analysis from the previous run's state
+# Appended rows cost O(new rows), a revised history or changed settings recompute everything
+# rolling=True adds the rolling regression, as in UnrateHouse.run_analysis, the significance tests are skipped
+def run_incremental_analysis(dir, nlag=24, col='house_diff', chunksize=None, dtype='float64',
+                             ma_windows=tuple(UnrateHouse.MA_WINDOWS), jobs=1, rolling=False):
+    master = UnrateHouse.process_raw_data(dir, chunksize=chunksize, dtype=dtype)
+    settings = {'nlag': nlag, 'col': col, 'dtype': dtype, 'ma_windows': list(ma_windows),
+                'windows': list(UnrateHouse.CORR_GRID_WINDOWS), 'lags': list(UnrateHouse.CORR_GRID_LAGS),
+                'rolling_window': UnrateHouse.ROLLING_WINDOW, 'rolling_step': UnrateHouse.ROLLING_STEP}
+    state = load_state(dir, settings)
+    if state is None or not is_append(state, master):
+        state = empty_state(settings)
+    rows_done, windows_done = len(state['master']), len(state['rolling_R2'])
+    if len(master) > rows_done:
+        state = append_rows(state, master)
+    if rolling:
+        state = extend_rolling(state, master)
+    if len(master) > rows_done or len(state['rolling_R2']) > windows_done:
+        save_state(dir, state)
+
+    ma_frame = pd.DataFrame(state['ma'], index=master.index, columns=[UnrateHouse.ma_column(window)
+                                                                      for window in ma_windows])
+    grid = UnrateHouse.correlation_from_sums(*state['corr_sums']).T
+    regression_result = UnrateHouse.regression_from_sums(state['xtx'], state['xty'], float(state['yty']),
+                                                         state['head_xtx'], state['head_xty'], state['head_yty'],
+                                                         nlag, len(master))
+    return UnrateHouse.build_analysis(master, nlag, col, ma_windows, jobs, cache_dir=dir + UnrateHouse.CACHE_DIR,
+                                      regression_result=regression_result,
+                                      rolling_regression=rolling_regression(state, master) if rolling else None,
+                                      ma_master=pd.concat([master, ma_frame], axis=1),
+                                      grid=UnrateHouse.correlation_grid_result(grid, settings['windows'],
+                                                                               settings['lags']))
@@ -0,0 +1,137 @@
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is then left out
+    resource = None
+
+# Stage profiler behind --profile. While disabled (PROFILE is None) every stage is a shared null context and
+# a decorated function costs one global lookup, so the instrumentation can stay in the hot paths.
+# Stages record wall time, the tracemalloc peak inside the stage, the process peak RSS and the shapes of
+# their array inputs. Stages run in worker processes are not recorded, only the stage that waits for them.
+PROFILE = None
+NULL_STAGE = nullcontext()
+
+
+# Collects the stages of one run
+class Profile:
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = time.perf_counter()
+
+    # Function to open a stage, its peak memory is the largest growth over the memory held when it started,
+    # including the peaks of its children
+    @contextmanager
+    def stage(self, name, **args):
+        stack = self.local.__dict__.setdefault('stack', [])
+        current = 0
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+            tracemalloc.reset_peak()
+        stack.append([current, current])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            current, peak = stack.pop()
+            if self.trace_memory:
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                if stack:
+                    stack[-1][1] = max(stack[-1][1], peak)
+                tracemalloc.reset_peak()
+            event = {'name': name, 'start': start - self.origin, 'duration': duration,
+                     'thread': threading.get_ident(), 'depth': len(stack), 'args': args}
+            if self.trace_memory:
+                event['peak_mb'] = (peak - current) / 2 ** 20
+            if resource is not None:
+                event['max_rss_mb'] = peak_rss_mb()
+            with self.lock:
+                self.events.append(event)
+
+    # Function to summarize the stages by name, ordered by total time
+    def summary(self):
+        df = pd.DataFrame(self.events)
+        if len(df) == 0:
+            return df
+        columns = {'calls': ('duration', 'size'), 'total_s': ('duration', 'sum'), 'max_s': ('duration', 'max')}
+        if 'peak_mb' in df:
+            columns['peak_mb'] = ('peak_mb', 'max')
+        if 'max_rss_mb' in df:
+            columns['max_rss_mb'] = ('max_rss_mb', 'max')
+        return df.groupby('name').agg(**columns).sort_values('total_s', ascending=False)
+
+    # Function to write the stages as a Chrome trace (chrome://tracing or https://ui.perfetto.dev)
+    def write_trace(self, path):
+        pid = os.getpid()
+        trace = [{'name': event['name'], 'cat': event['name'].split(':')[0], 'ph': 'X', 'pid': pid,
+                  'tid': event['thread'], 'ts': event['start'] * 1e6, 'dur': event['duration'] * 1e6,
+                  'args': {**event['args'], **{key: event[key] for key in ('peak_mb', 'max_rss_mb') if key in event}}}
+                 for event in self.events]
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file, default=str)
+        return path
+
+# Function to read the peak resident memory of the process (ru_maxrss is in KB on Linux, bytes on macOS)
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+# Function to start profiling, trace_memory also starts tracemalloc (which slows down python allocations)
+def enable(trace_memory=True):
+    global PROFILE
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    PROFILE = Profile(trace_memory)
+    return PROFILE
+
+# Function to stop profiling, returns the finished profile
+def disable():
+    global PROFILE
+    profile, PROFILE = PROFILE, None
+    if profile is not None and profile.trace_memory:
+        tracemalloc.stop()
+    return profile
+
+# Function to time a block as a stage, e.g. with stage('pdflatex', file=name):
+def stage(name, **args):
+    if PROFILE is None:
+        return NULL_STAGE
+    return PROFILE.stage(name, **args)
+
+# Function to describe the inputs of a profiled call, the shape of every array and frame argument
+def input_sizes(parameters, args, kwargs):
+    sizes = {}
+    for key, value in list(zip(parameters, args)) + list(kwargs.items()):
+        if hasattr(value, 'shape'):
+            sizes[key] = list(value.shape)
+    return sizes
+
+# Decorator to time every call of a function as a stage named name
+def profiled(name):
+    def decorator(function):
+        parameters = list(inspect.signature(function).parameters)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if PROFILE is None:
+                return function(*args, **kwargs)
+            with PROFILE.stage(name, **input_sizes(parameters, args, kwargs)):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,28 +1,107 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import statsmodels.api as sm
-import seaborn as sns
-from datetime import datetime, date
-from statsmodels.tsa.stattools import adfuller
-from matplotlib.ticker import FormatStrFormatter
-from pandas.plotting import scatter_matrix
-from plotly.offline import plot
-import subprocess
-import plotly.graph_objs as go
-from plotly.subplots import make_subplots
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import base64
+import gzip
+import hashlib
+import io
 import json
-
-# Function to manipulate raw data
-def process_raw_data(dir):
-    df_unrate = pd.read_csv(dir + 'UNRATE.csv')
-    df_unrate = df_unrate.set_index(pd.to_datetime(df_unrate['DATE']))
-    df_unrate = df_unrate.drop(['DATE'], axis=1)
-
-    df_house = pd.read_csv(dir + 'MSPNHSUS.csv')
-    df_house = df_house.set_index(pd.to_datetime(df_house['DATE']))
-    df_house = df_house.drop(['DATE'], axis=1)
-
+import marshal
+import os
+import re
+import shutil
+import sys
+import threading
+from string import Template
+from Reporting.Profiler import profiled, stage
+
+# matplotlib, seaborn, statsmodels, plotly and subprocess are imported inside the functions that use them,
+# so reports that do not plot (e.g. excel) skip their import cost
+
+# Moving average windows (in months) applied to the first difference of housing price
+MA_WINDOWS = [6, 12, 24, 36, 48, 60]
+# Moving averages offered in the interactive chart of the html report
+HTML_MA_WINDOWS = [12, 24, 36, 48]
+# Moving average shown with its optimal lag in the time series graph after lags
+AFTER_MA_WINDOW = 12
+# MA windows and lags searched by the correlation grid
+CORR_GRID_WINDOWS = range(1, 121)
+CORR_GRID_LAGS = range(0, 37)
+# Correlations over fewer pairs than this are left out (NaN), so short samples cannot pick a spurious +-1
+CORR_MIN_PAIRS = 24
+# Window (in months) and step of the rolling lag regression
+ROLLING_WINDOW = 240
+ROLLING_STEP = 1
+# Rows spanned by one chunk of rolling windows whose normal equations are built and solved together
+ROLLING_CHUNK = 1024
+# Block bootstrap behind the confidence intervals of the lag correlations and R2, 0 resamples skips the
+# significance tests. Blocks of BOOTSTRAP_BLOCK months keep the autocorrelation of the monthly series.
+BOOTSTRAP_RESAMPLES = 1000
+BOOTSTRAP_BLOCK = 24
+BOOTSTRAP_SEED = 0
+# Resamples per task of the process pool. Every task draws from its own seeded stream, so the intervals
+# depend on the seed and not on the processes.
+BOOTSTRAP_CHUNK = 250
+CONFIDENCE_LEVEL = 0.95
+# Circular shifts drawn for the permutation null, and the distance they keep from the observed alignment
+PERMUTATION_SHIFTS = 999
+PERMUTATION_MIN_SHIFT = 24
+# Inputs longer than this skip the significance tests, their cost grows with rows x resamples
+SIGNIFICANCE_MAX_ROWS = 5000
+# Scatter matrix panels with more points than this are drawn as 2-D histograms of DENSITY_BINS x DENSITY_BINS
+SCATTER_MAX_POINTS = 5000
+DENSITY_BINS = 60
+# Grid points of the diagonal KDE of the scatter matrix
+KDE_GRIDSIZE = 512
+# Points kept per line of a time series chart, about the pixel width of the charts, longer series are downsampled
+DOWNSAMPLE_POINTS = 2000
+# Recession periods (NBER business cycle peak to trough) and unemployment break dates drawn on the time series
+RECESSION_EVENTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'recession_events.csv')
+# LaTeX template of the pdf report and the folder holding it
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+LATEX_TEMPLATE = 'unemployment_house_report.tex'
+# Default pdflatex of a Windows MiKTeX install, used when pdflatex is not on PATH
+MIKTEX_PDFLATEX = r"C:\Users\siaha\AppData\Local\Programs\MiKTeX\miktex\bin\x64\pdflatex"
+# pdflatex is rerun at most this many times while the log asks for a rerun
+LATEX_MAX_RUNS = 3
+# Folder (inside CACHE_DIR) holding the input hash of the last compile of every pdf, one file per pdf so
+# reports compiled at the same time by several threads or processes never rewrite a shared file
+LATEX_KEYS_DIR = 'latex/'
+# Decimals kept for the series embedded in the html report
+HTML_DECIMALS = 2
+# Stylesheet inlined in offline html bundles instead of Bootstrap, it covers the classes used by the report
+OFFLINE_CSS = '''
+*,::after,::before{box-sizing:border-box}
+body{margin:0;font-family:system-ui,-apple-system,"Segoe UI",Roboto,"Helvetica Neue",Arial,sans-serif;line-height:1.5}
+h1,h2{font-weight:500;line-height:1.2}
+.table{width:100%;margin-bottom:1rem;vertical-align:top;border-collapse:collapse;border-color:#373b3e}
+.table>:not(caption)>*>*{padding:.5rem;border-bottom:1px solid #373b3e}
+.table-dark{color:#fff;background-color:#212529}
+.table-striped>tbody>tr:nth-of-type(odd)>*{background-color:rgba(255,255,255,.05)}
+.form-select{display:block;width:100%;padding:.375rem 2.25rem .375rem .75rem;font-size:1rem;border-radius:.25rem}
+'''
+# Columns compared in the correlation plot and matrix of the moving averages
+MA_CORR_COLUMNS = ['UNRATE', 'house_diff','house_6MA','house_12MA','house_24MA','house_36MA','house_48MA']
+# Source csv files and the columns of the merged master frame
+INPUT_FILES = ['UNRATE.csv', 'MSPNHSUS.csv']
+MASTER_COLUMNS = ['UNRATE', 'MSPNHSUS', 'house_diff', 'house_return']
+# Folder (inside the output directory) holding cached intermediate results
+CACHE_DIR = '.cache/'
+# ADF results already computed in this process, keyed by the hash of the tested column, oldest dropped first
+ADF_RESULTS = {}
+ADF_CACHE_SIZE = 4096
+
+# Function to read one FRED csv file, its value column is renamed to column
+def read_fred_csv(path, column):
+    df = pd.read_csv(path)
+    df = df.set_index(pd.to_datetime(df['DATE']))
+    df = df.drop(['DATE'], axis=1)
+    df.columns = [column]
+    return df
+
+# Function to merge an unemployment series with a house price series
+def build_master(df_unrate, df_house):
     master = pd.concat([df_unrate, df_house], axis=1)
     master['house_diff'] = master['MSPNHSUS'].diff(1)
     master['house_return'] = master['MSPNHSUS'].pct_change(1)
@@ -30,38 +109,467 @@ def process_raw_data(dir):
 
     return master
 
-# Function to run stationary test
-def stationary_test(df):
-    colList = ['UNRATE','MSPNHSUS','house_diff','house_return']
-    descriptionList = ['Unemployment Rate','Median Housing Price Over Time',
-                       'First diff of housing Price','Return of housing Price']
-
-    resultdf = pd.DataFrame(columns=['Column', 'P-Value', 'Result', 'Description'])
-    for col in range(len(colList)):
-        dftest = adfuller(df[colList[col]], autolag='AIC')
-        if dftest[0] < dftest[4]["5%"]:
-            result = 'stationary'
+# Function to manipulate raw data
+def read_raw_data(dir):
+    df_unrate = read_fred_csv(dir + 'UNRATE.csv', 'UNRATE')
+    df_house = read_fred_csv(dir + 'MSPNHSUS.csv', 'MSPNHSUS')
+    return build_master(df_unrate, df_house)
+
+# Function to read one csv source in chunks with explicit dtypes and parsed dates
+def read_csv_chunks(dir, file_name, chunksize, dtype):
+    column = file_name[:-len('.csv')]
+    return pd.read_csv(dir + file_name, chunksize=chunksize, index_col='DATE', parse_dates=['DATE'],
+                       dtype={column: dtype}, na_values=['.'])
+
+# Function to stream the master frame chunk by chunk, memory stays bounded by chunksize
+# Both sources are sorted by date, rows up to the earliest last date of the pending chunks are aligned,
+# and the last house price is carried over so house_diff/house_return match the full file computation
+def iter_raw_data_chunks(dir, chunksize=100000, dtype='float64'):
+    readers = [read_csv_chunks(dir, file_name, chunksize, dtype) for file_name in INPUT_FILES]
+    pending = [next(reader) for reader in readers]
+    done = [False] * len(readers)
+    prev_house = np.nan
+
+    while True:
+        # Every source still being read needs at least one pending row to define the alignment horizon
+        for k, reader in enumerate(readers):
+            while not done[k] and len(pending[k]) == 0:
+                chunk = next(reader, None)
+                if chunk is None:
+                    done[k] = True
+                else:
+                    pending[k] = chunk
+        if all(done) and all(len(part) == 0 for part in pending):
+            break
+
+        open_ends = [pending[k].index[-1] for k in range(len(readers)) if not done[k]]
+        horizon = min(open_ends) if open_ends else None
+        ready = []
+        for k in range(len(readers)):
+            if horizon is None:
+                ready.append(pending[k])
+                pending[k] = pending[k].iloc[0:0]
+            else:
+                ready.append(pending[k].loc[:horizon])
+                pending[k] = pending[k].loc[pending[k].index > horizon]
+
+        aligned = pd.concat(ready, axis=1).sort_index()
+        if len(aligned) == 0:
+            continue
+        house = aligned['MSPNHSUS'].to_numpy()
+        prev = np.concatenate([[prev_house], house[:-1]]).astype(house.dtype)
+        prev_house = house[-1]
+        aligned['house_diff'] = house - prev
+        with np.errstate(divide='ignore', invalid='ignore'):
+            aligned['house_return'] = house / prev - 1
+        yield aligned.dropna()
+
+# Function to manipulate raw data in streaming mode, for sources too large to load whole
+def read_raw_data_streaming(dir, chunksize=100000, dtype='float64'):
+    master = pd.concat(list(iter_raw_data_chunks(dir, chunksize, dtype)))
+    master.index = pd.DatetimeIndex(master.index, name='DATE', freq='infer')
+    return master
+
+# Function to describe the source csv files, mtime and size are checked first and the content hash decides
+def input_signature(dir, previous=None):
+    signature = {}
+    for file_name in INPUT_FILES:
+        stat = os.stat(dir + file_name)
+        entry = {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+        old_entry = (previous or {}).get(file_name)
+        if old_entry and old_entry['mtime'] == entry['mtime'] and old_entry['size'] == entry['size']:
+            entry['sha256'] = old_entry['sha256']
         else:
-            result = 'non-stationary'
-        # Create a new row as a dictionary
-        new_row = [col, dftest[1], result, descriptionList[col]]
-        # Append the new row
-        resultdf.loc[len(resultdf)] = new_row
+            digest = hashlib.sha256()
+            with open(dir + file_name, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(block)
+            entry['sha256'] = digest.hexdigest()
+        signature[file_name] = entry
+    return signature
+
+# Function to load the cached master frame, returns None when the csv files changed since it was written
+def load_cached_master(dir, dtype='float64'):
+    cache_path = dir + CACHE_DIR + 'master.npz'
+    if not os.path.exists(cache_path):
+        return None
+    with np.load(cache_path, allow_pickle=False) as cache:
+        if cache['UNRATE'].dtype != np.dtype(dtype):
+            return None
+        stored = json.loads(str(cache['signature']))
+        signature = input_signature(dir, stored)
+        if any(signature[name]['sha256'] != stored.get(name, {}).get('sha256') for name in INPUT_FILES):
+            return None
+        master = pd.DataFrame({col: cache[col] for col in MASTER_COLUMNS},
+                              index=pd.DatetimeIndex(cache['DATE'], name='DATE', freq='infer'))
+    if signature != stored:
+        # Files were touched but not changed, refresh the mtimes so the next run skips hashing
+        save_cached_master(dir, master, signature)
+    return master
+
+# Function to write the master frame as typed numpy columns next to the inputs
+def save_cached_master(dir, master, signature=None):
+    os.makedirs(dir + CACHE_DIR, exist_ok=True)
+    signature = signature or input_signature(dir)
+    columns = {col: master[col].to_numpy() for col in MASTER_COLUMNS}
+    with open(dir + CACHE_DIR + 'master.npz', 'wb') as file:
+        np.savez(file, DATE=master.index.to_numpy(), signature=np.array(json.dumps(signature)), **columns)
+
+# Function to get the master frame, parsing the csv files only when the cache is missing or stale
+# chunksize switches to streaming ingestion, dtype='float32' halves the memory of the value columns
+@profiled('ingest')
+def process_raw_data(dir, use_cache=True, chunksize=None, dtype='float64'):
+    if use_cache:
+        master = load_cached_master(dir, dtype)
+        if master is not None:
+            return master
+    if chunksize:
+        master = read_raw_data_streaming(dir, chunksize, dtype)
+    else:
+        master = read_raw_data(dir).astype(dtype)
+    if use_cache:
+        save_cached_master(dir, master)
+    return master
+
+STATIONARY_COLUMNS = ['UNRATE','MSPNHSUS','house_diff','house_return']
+STATIONARY_DESCRIPTIONS = ['Unemployment Rate','Median Housing Price Over Time',
+                           'First diff of housing Price','Return of housing Price']
+
+# Function to run the ADF test on one column, returns the statistic, p-value and 5% critical value
+def adf_test(values):
+    from statsmodels.tsa.stattools import adfuller
+    dftest = adfuller(values, autolag='AIC')
+    return float(dftest[0]), float(dftest[1]), float(dftest[4]["5%"])
+
+# Function to key an ADF result by the data of the column
+def adf_key(values):
+    return hashlib.sha256(np.ascontiguousarray(values, dtype=float).tobytes()).hexdigest()
+
+# Function to run the ADF tests of many columns, tests already run on the same data are reused
+# jobs > 1 runs the missing tests on a process pool, cache_dir keeps the results of the last call across runs
+# (only the columns of that call, so the file does not grow with every new month or backfill date)
+def adf_tests(columns, jobs=1, cache_dir=None):
+    stored = {}
+    if cache_dir is not None and os.path.exists(cache_dir + 'adf.json'):
+        with open(cache_dir + 'adf.json') as file:
+            stored = {key: tuple(result) for key, result in json.load(file).items()}
+        for key, result in stored.items():
+            ADF_RESULTS.setdefault(key, result)
+
+    keys = [adf_key(values) for values in columns]
+    missing = {key: values for key, values in zip(keys, columns) if key not in ADF_RESULTS}
+    if jobs <= 1 or len(missing) <= 1:
+        results = [adf_test(values) for values in missing.values()]
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(missing))) as executor:
+            results = list(executor.map(adf_test, missing.values()))
+    ADF_RESULTS.update(zip(missing.keys(), results))
+
+    call_results = {key: ADF_RESULTS[key] for key in keys}
+    # Only the most recent results stay in the process, a long running server sees many inputs
+    for key in list(ADF_RESULTS)[:max(0, len(ADF_RESULTS) - ADF_CACHE_SIZE)]:
+        del ADF_RESULTS[key]
+
+    if cache_dir is not None and call_results != stored:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_dir + 'adf.json', 'w') as file:
+            json.dump(call_results, file)
+    return [call_results[key] for key in keys]
+
+# Function to run stationary test, colList can hold any column of df such as MA or lag features
+@profiled('adf')
+def stationary_test(df, colList=None, descriptionList=None, jobs=1, cache_dir=None):
+    if colList is None:
+        colList = STATIONARY_COLUMNS
+        descriptionList = STATIONARY_DESCRIPTIONS
+    if descriptionList is None:
+        descriptionList = list(colList)
+
+    results = adf_tests([df[col].dropna().to_numpy(dtype=float) for col in colList], jobs, cache_dir)
+    return stationary_result_frame(results, colList, descriptionList)
+
+# Function to build the stationary test table from ADF results
+def stationary_result_frame(results, colList, descriptionList):
+    resultdf = pd.DataFrame({
+        'Column': colList,
+        'P-Value': [p_value for statistic, p_value, critical in results],
+        'Result': ['stationary' if statistic < critical else 'non-stationary'
+                   for statistic, p_value, critical in results],
+        'Description': descriptionList,
+    })
 
     return resultdf
 
+# Function to compute the moving averages of values for every window in one cumulative sum pass
+# Returns a contiguous (rows x windows) array, rows before a full window (or with a NaN inside it) are NaN
+def moving_average_matrix(values, windows):
+    values = np.asarray(values, dtype=float)
+    windows = np.asarray(windows, dtype=int)
+    missing = np.isnan(values)
+    csum = np.concatenate([[0.0], np.cumsum(np.where(missing, 0.0, values))])
+    cmissing = np.concatenate([[0], np.cumsum(missing)])
+
+    end = np.arange(1, len(values) + 1)[:, None]
+    start = end - windows[None, :]
+    valid = start >= 0
+    start = np.where(valid, start, 0)
+    ma = (csum[end] - csum[start]) / windows[None, :]
+    ma[~valid | (cmissing[end] - cmissing[start] > 0)] = np.nan
+    return np.ascontiguousarray(ma)
+
+# Function to name the moving average column of a window
+def ma_column(window):
+    return 'house_' + str(window) + 'MA'
+
+# Function to add moving average columns of house_diff
+@profiled('moving_averages')
+def add_moving_averages(master, windows=MA_WINDOWS):
+    ma = moving_average_matrix(master['house_diff'].to_numpy(), windows)
+    ma_frame = pd.DataFrame(ma, index=master.index, columns=[ma_column(window) for window in windows])
+    return pd.concat([master, ma_frame], axis=1)
+
+# Function to prepare a moving average matrix for lag_correlation_sums: the moving averages with NaN set to 0
+# (in place) and the valid mask as floats
+def correlation_inputs(ma):
+    valid = (~np.isnan(ma)).astype(float)
+    return np.nan_to_num(ma, copy=False), valid
+
+# Function to compute the correlation sums between UNRATE and every MA column at one lag
+# Row r pairs UNRATE at row r + lag with the moving averages at row r, for the pair rows start..end, rows with
+# a missing MA add nothing. The sums are reductions and matrix-vector products over row views of x and valid
+# (from correlation_inputs), so no rows x windows temporary is built.
+# Returns count, sx, sy, sxx, syy, sxy stacked as a (6 x windows) array
+def lag_correlation_sums(x, valid, y, lag, start=0, end=None):
+    end = max(len(y) - lag, start) if end is None else end
+    x, valid = x[start:end], valid[start:end]
+    y_lag = y[start + lag:end + lag]
+    return np.stack([valid.sum(axis=0), x.sum(axis=0), y_lag @ valid, np.einsum('ij,ij->j', x, x),
+                     (y_lag * y_lag) @ valid, y_lag @ x])
+
+# Function to turn the correlation sums into correlations
+# Cells with fewer than CORR_MIN_PAIRS pairs, a zero variance or rounding beyond +-1 are NaN
+def correlation_from_sums(count, sx, sy, sxx, syy, sxy):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = (count * sxy - sx * sy) / np.sqrt((count * sxx - sx ** 2) * (count * syy - sy ** 2))
+        return np.where((count >= CORR_MIN_PAIRS) & np.isfinite(corr) & (np.abs(corr) <= 1), corr, np.nan)
+
+# Function to package a (MA window x lag) correlation grid with its strongest combinations
+def correlation_grid_result(grid, windows, lags):
+    grid_df = pd.DataFrame(grid, index=pd.Index(windows, name='MA Window'), columns=pd.Index(lags, name='Lag'))
+    strength = np.where(np.isfinite(grid), np.abs(grid), -np.inf)
+    has_value = np.isfinite(strength).any(axis=1)
+    best_lag_by_window = pd.Series(np.array(lags)[strength.argmax(axis=1)], index=grid_df.index,
+                                   name='Best Lag').where(has_value).astype('Int64')
+    if not has_value.any():
+        return {'grid': grid_df, 'best_window': None, 'best_lag': None, 'best_corr': np.nan,
+                'best_lag_by_window': best_lag_by_window}
+    best = np.unravel_index(strength.argmax(), grid.shape)
+    return {
+        'grid': grid_df,
+        'best_window': windows[best[0]],
+        'best_lag': lags[best[1]],
+        'best_corr': grid[best],
+        'best_lag_by_window': best_lag_by_window,
+    }
+
+# Function to correlate UNRATE with every (MA window x lag) combination of col
+# Lag L pairs UNRATE at month t with the moving average at month t - L, using shifted views of one MA matrix
+# Returns the grid (index MA window, columns lag), the overall strongest combination and the best lag per window
+@profiled('correlation_grid')
+def correlation_grid(master, windows=CORR_GRID_WINDOWS, lags=CORR_GRID_LAGS, col='house_diff'):
+    windows = list(windows)
+    lags = list(lags)
+    x, valid = correlation_inputs(moving_average_matrix(master[col].to_numpy(), windows))
+    y = master['UNRATE'].to_numpy(dtype=float)
+
+    grid = np.full((len(windows), len(lags)), np.nan)
+    for j, lag in enumerate(lags):
+        grid[:, j] = correlation_from_sums(*lag_correlation_sums(x, valid, y, lag))
+
+    return correlation_grid_result(grid, windows, lags)
+
+# Function to find how many rows of index fall on or before each as of date
+def as_of_positions(index, as_of_dates):
+    return np.searchsorted(index.to_numpy(), pd.DatetimeIndex(as_of_dates).to_numpy(), side='right')
+
+# Function to compute the correlation grid as of many dates from one expanding pass
+# The correlation sums only grow with new rows, so the dates are visited in order and each adds the sums of
+# the rows since the previous date instead of recomputing
+def expanding_correlation_grid(master, as_of_dates, windows=CORR_GRID_WINDOWS, lags=CORR_GRID_LAGS,
+                               col='house_diff'):
+    windows = list(windows)
+    lags = list(lags)
+    x, valid = correlation_inputs(moving_average_matrix(master[col].to_numpy(), windows))
+    y = master['UNRATE'].to_numpy(dtype=float)
+    positions = as_of_positions(master.index, as_of_dates)
+    order = np.argsort(positions, kind='stable')
+
+    grids = np.full((len(positions), len(windows), len(lags)), np.nan)
+    for j, lag in enumerate(lags):
+        sums, done = np.zeros((6, len(windows))), 0
+        for k in order:
+            end = int(np.clip(positions[k] - lag, 0, max(len(y) - lag, 0)))
+            if end > done:
+                sums = sums + lag_correlation_sums(x, valid, y, lag, done, end)
+                done = end
+            grids[k, :, j] = correlation_from_sums(*sums)
+
+    return {as_of: correlation_grid_result(grids[k], windows, lags) for k, as_of in enumerate(as_of_dates)}
+
+# Function to build the analysis dict every report renders from, shared by the full, incremental, backfill and
+# benchmark runs. Parts passed in (e.g. from running sums, grid is the correlation_grid result) are used as they
+# are, the others are computed here.
+# resamples > 0 adds the significance tests and rolling=True the rolling regression (only the pdf and the
+# features workbook show it), skipped ones are None
+def build_analysis(master, nlag=24, col='house_diff', ma_windows=tuple(MA_WINDOWS), jobs=1, resamples=0,
+                   rolling=False, cache_dir=None, stationary_result=None, regression_result=None,
+                   rolling_regression=None, ma_master=None, grid=None):
+    if rolling_regression is None and rolling:
+        rolling_regression = rolling_ols_regression_lag(master, nlag, col)
+    return {
+        'master': master,
+        'stationary_result': (stationary_test(master, jobs=jobs, cache_dir=cache_dir) if stationary_result is None
+                              else stationary_result),
+        'regression_result': ols_regression_lag(master, nlag, col) if regression_result is None else regression_result,
+        'rolling_regression': rolling_regression,
+        'ma_master': add_moving_averages(master, ma_windows) if ma_master is None else ma_master,
+        'correlation_grid': correlation_grid(master) if grid is None else grid,
+        'significance': analysis_significance(master, nlag, col, resamples, jobs, cache_dir),
+    }
+
+# Function to run the shared analysis once, every report format renders from its result
+# as_of keeps only the observations available on that date, resamples and rolling as in build_analysis
+@lru_cache(maxsize=None)
+@profiled('analysis')
+def run_analysis(dir, nlag=24, col='house_diff', chunksize=None, dtype='float64', ma_windows=tuple(MA_WINDOWS),
+                 jobs=1, as_of=None, resamples=0, rolling=False):
+    master = process_raw_data(dir, chunksize=chunksize, dtype=dtype)
+    if as_of is not None:
+        master = master.loc[:as_of]
+    return build_analysis(master, nlag, col, ma_windows, jobs, resamples, rolling, dir + CACHE_DIR)
+
+# Function to import pyplot on first use, with the Agg backend as figures are only written to files
+# (also safe inside worker processes)
+def pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+# Function to read the recession and event table, start and end are dates (end is empty for single date events)
+@lru_cache(maxsize=None)
+def recession_events(path=RECESSION_EVENTS):
+    return pd.read_csv(path, parse_dates=['start', 'end'])
+
+# Function to keep the events of kinds that fall inside the dates of index, spans are clipped to index
+def visible_events(events, index, kinds=('recession', 'break')):
+    first, last = index.min(), index.max()
+    end = events['end'].fillna(events['start'])
+    events = events[events['kind'].isin(kinds) & (end >= first) & (events['start'] <= last)].copy()
+    events['start'] = events['start'].clip(lower=first)
+    events['end'] = events['end'].clip(upper=last)
+    return events
+
+# Function to draw the events on the primary axes of a time series, all recession spans as one collection and
+# all break dates as one line collection, spanning the full height of ax whatever its y limits
+def add_event_layer(ax, events, index, kinds=('recession', 'break')):
+    from matplotlib.collections import LineCollection, PolyCollection
+    from matplotlib.dates import date2num
+    events = visible_events(events, index, kinds)
+    spans = events[events['kind'] == 'recession']
+    if len(spans):
+        starts = date2num(spans['start'].to_numpy())
+        ends = date2num(spans['end'].to_numpy())
+        ax.add_collection(PolyCollection([[(x0, 0), (x0, 1), (x1, 1), (x1, 0)] for x0, x1 in zip(starts, ends)],
+                                         transform=ax.get_xaxis_transform(), facecolor='gray', edgecolor='none',
+                                         alpha=0.1), autolim=False)
+    breaks = events[events['kind'] == 'break']
+    if len(breaks):
+        ax.add_collection(LineCollection([[(x, 0), (x, 1)] for x in date2num(breaks['start'].to_numpy())],
+                                         transform=ax.get_xaxis_transform(), colors='r', linestyles='--',
+                                         alpha=0.5), autolim=False)
+    return ax
+
+# Function to describe the events as plotly layout shapes, for the interactive time series of the html report
+def plotly_event_shapes(events, index, kinds=('recession', 'break')):
+    events = visible_events(events, index, kinds)
+    shapes = []
+    for kind, start, end in zip(events['kind'], events['start'], events['end']):
+        if kind == 'recession':
+            shapes.append(dict(type='rect', xref='x', yref='paper', x0=start.strftime('%Y-%m-%d'),
+                               x1=end.strftime('%Y-%m-%d'), y0=0, y1=1, fillcolor='gray', opacity=0.2,
+                               line=dict(width=0), layer='below'))
+        else:
+            shapes.append(dict(type='line', xref='x', yref='paper', x0=start.strftime('%Y-%m-%d'),
+                               x1=start.strftime('%Y-%m-%d'), y0=0, y1=1,
+                               line=dict(color='red', dash='dash', width=1), opacity=0.5))
+    return shapes
+
+# Function to pick n_out points of (x, y) with Largest-Triangle-Three-Buckets, which keeps the visual shape
+# (peaks, troughs, turning points) of the line. The first and last points are always kept.
+def lttb_indices(x, y, n_out):
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        next_hi = edges[b + 2] if b + 2 < len(edges) else n
+        avg_x, avg_y = x[hi:next_hi].mean(), y[hi:next_hi].mean()
+        # Twice the area of the triangle (previous point, candidate, average of the next bucket)
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[b + 1] = a
+    return selected
+
+# Function to pick the minimum and maximum of y in each of n_out / 2 even buckets, with the first and last points
+def minmax_indices(y, n_out):
+    n = len(y)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+    edges = np.linspace(0, n, n_out // 2 + 1).astype(int)
+    selected = [0, n - 1]
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        selected += [lo + int(np.argmin(y[lo:hi])), lo + int(np.argmax(y[lo:hi]))]
+    return np.unique(selected)
+
+# Function to pick at most n_out positions of a series to plot, method is 'lttb' or 'minmax'
+# Missing values are left out, series with at most n_out values are kept whole
+def downsample_indices(series, n_out=DOWNSAMPLE_POINTS, method='lttb'):
+    y = series.to_numpy(dtype=float)
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= n_out:
+        return valid
+    if method == 'minmax':
+        return valid[minmax_indices(y[valid], n_out)]
+    x = series.index.asi8 if isinstance(series.index, pd.DatetimeIndex) else np.arange(len(y))
+    x = (x[valid] - x[valid[0]]).astype(float)
+    return valid[lttb_indices(x, y[valid], n_out)]
+
+# Function to downsample a series before plotting, see downsample_indices
+def downsample_series(series, n_out=DOWNSAMPLE_POINTS, method='lttb'):
+    if series.notna().sum() <= n_out:
+        return series
+    return series.iloc[downsample_indices(series, n_out, method)]
+
 # Function to graph time series with raw data
-def timeseries_recession_graph(master, dir):
+def timeseries_recession_graph(master, events, dir):
+    plt = pyplot()
     # Created a graph to visualize the raw data
     fig, ax1 = plt.subplots(figsize=(18, 8))
-    line1 = ax1.plot(master.index, 'UNRATE', data=master, color='tab:blue', label='Unemployment')
+    unrate = downsample_series(master['UNRATE'])
+    line1 = ax1.plot(unrate.index, unrate.to_numpy(), color='tab:blue', label='Unemployment')
     ax1.set_xlabel('Year', fontdict={'fontsize': 15, 'fontweight': 'medium'})
     ax1.set_ylabel('Unemploymet Rate %', fontdict={'fontsize': 15, 'fontweight': 'medium'})
     ax1.set_title('Unemploymet Rate and Housing Price Over Time', fontdict={'fontsize': 20, 'fontweight': 'medium'})
     ax1.grid(True)
 
     ax2 = ax1.twinx()  # instantiate a second axes that shares the same x-axis
-    line2 = ax2.plot(master.index, 'MSPNHSUS', data=master, color='tab:gray', alpha=0.5, label='House Price')
+    house = downsample_series(master['MSPNHSUS'])
+    line2 = ax2.plot(house.index, house.to_numpy(), color='tab:gray', alpha=0.5, label='House Price')
     ax2.tick_params(axis='y')
     ax2.set_ylabel('Median House Sales Price $', size=15)
 
@@ -69,64 +577,109 @@ def timeseries_recession_graph(master, dir):
     labels = [line.get_label() for line in lines]
     ax1.legend(lines, labels, loc='upper left')
 
-    # Year period for recessions defined by Wikipedia list of recessions
-    ax3 = ax1.twinx()
-    ax3.axvspan(datetime(1980, 1, 1), datetime(1980, 7, 1), alpha=0.1, color='gray')
-    ax3.axis('off')
-    ax4 = ax1.twinx()
-    ax4.axvspan(datetime(1981, 7, 1), datetime(1982, 11, 1), alpha=0.1, color='gray')
-    ax4.axis('off')
-    ax5 = ax1.twinx()
-    ax5.axvspan(datetime(1990, 7, 1), datetime(1991, 3, 1), alpha=0.1, color='gray')
-    ax5.axis('off')
-    ax6 = ax1.twinx()
-    ax6.axvspan(datetime(2001, 3, 1), datetime(2001, 11, 1), alpha=0.1, color='gray')
-    ax6.axis('off')
-    ax7 = ax1.twinx()
-    ax7.axvspan(datetime(2007, 12, 1), datetime(2009, 6, 1), alpha=0.1, color='gray')
-    ax7.axis('off')
-    ax8 = ax1.twinx()
-    ax8.axvspan(datetime(2020, 2, 1), datetime(2020, 4, 1), alpha=0.1, color='gray')
-    ax8.axis('off')
-    ax9 = ax1.twinx()
-    ax9.axvspan(datetime(1973, 11, 1), datetime(1975, 3, 1), alpha=0.1, color='gray')
-    ax9.axis('off')
+    add_event_layer(ax1, events, master.index, kinds=('recession',))
     # rotates and right aligns the x labels, and moves the bottom of the
     # axes up to make room for them
     fig.autofmt_xdate()
     fig.tight_layout()  # otherwise the right y-label is slightly clipped
-    plt.savefig(dir)
+    fig.savefig(dir)
+    plt.close(fig)
 
     return 0
 
+# Function to estimate a gaussian KDE on an even grid by binning the values and convolving the bin counts
+# with the kernel through an FFT, so the cost grows with the grid size instead of rows x grid points
+# The bandwidth follows Scott's rule like scipy.stats.gaussian_kde, the grid covers min to max of values
+def binned_kde(values, gridsize=KDE_GRIDSIZE):
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) < 2 or np.ptp(values) == 0 or np.std(values, ddof=1) == 0:
+        return None, None
+    bandwidth = np.std(values, ddof=1) * len(values) ** (-1 / 5)
+    grid = np.linspace(values.min(), values.max(), gridsize)
+    step = grid[1] - grid[0]
+
+    # Linear binning: every value splits its weight between the two nearest grid points
+    position = (values - grid[0]) / step
+    left = np.minimum(np.floor(position).astype(int), gridsize - 2)
+    weight = position - left
+    counts = (np.bincount(left, 1 - weight, minlength=gridsize) +
+              np.bincount(left + 1, weight, minlength=gridsize))
+
+    reach = min(int(np.ceil(4 * bandwidth / step)), gridsize)
+    offsets = np.arange(-reach, reach + 1) * step
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (bandwidth * np.sqrt(2 * np.pi))
+    size = 1 << int(np.ceil(np.log2(gridsize + len(kernel))))
+    density = np.fft.irfft(np.fft.rfft(counts, size) * np.fft.rfft(kernel, size), size)[reach:reach + gridsize]
+    return grid, np.maximum(density, 0) / len(values)
+
+# Function to draw the lower triangle of a scatter matrix of columns on fig, with a KDE on the diagonal
+# Panels with more than max_points points are drawn as 2-D histograms (log counts), so the drawing cost stays flat
+# as rows grow. Each column is binned once and a panel only counts its pairs of bin numbers.
+# Only the lower triangle axes are created, with the same 5% padded limits as pandas.plotting.scatter_matrix
+def scatter_matrix_lower(fig, df, columns, max_points=SCATTER_MAX_POINTS, color="#0392cf"):
+    n = len(columns)
+    grid = fig.add_gridspec(n, n, wspace=0, hspace=0)
+    values = {col: df[col].to_numpy(dtype=float) for col in columns}
+    limits = {}
+    for col in columns:
+        low, high = np.nanmin(values[col]), np.nanmax(values[col])
+        padding = (high - low) * 0.05 / 2
+        limits[col] = (low - padding, high + padding)
+    dense = len(df) > max_points
+    if dense:
+        bins = {col: np.clip(((np.nan_to_num(values[col], nan=limits[col][0]) - limits[col][0]) /
+                              (limits[col][1] - limits[col][0]) * DENSITY_BINS).astype(int), 0, DENSITY_BINS - 1)
+                for col in columns}
+
+    axes = np.full((n, n), None, dtype=object)
+    for i, row_col in enumerate(columns):
+        for j, col in enumerate(columns[:i + 1]):
+            ax = fig.add_subplot(grid[i, j])
+            axes[i, j] = ax
+            if i == j:
+                x, density = binned_kde(values[col])
+                if x is not None:
+                    ax.plot(x, density, color=color)
+            else:
+                valid = ~np.isnan(values[col]) & ~np.isnan(values[row_col])
+                if dense and valid.sum() > max_points:
+                    counts = np.bincount(bins[row_col][valid] * DENSITY_BINS + bins[col][valid],
+                                         minlength=DENSITY_BINS ** 2).reshape(DENSITY_BINS, DENSITY_BINS)
+                    ax.imshow(np.ma.masked_equal(np.log1p(counts), 0), origin='lower', aspect='auto', cmap='Blues',
+                              extent=limits[col] + limits[row_col], interpolation='nearest')
+                else:
+                    ax.scatter(values[col][valid], values[row_col][valid], color=color, alpha=0.5, marker='.')
+                ax.set_ylim(limits[row_col])
+            ax.set_xlim(limits[col])
+            if i == n - 1:
+                ax.set_xlabel(col)
+            if j == 0:
+                ax.set_ylabel(row_col)
+    return axes
+
 # Function to create correlation plot
 def correlation_plot(master, list,dir):
-    # diagonal is graphed by kernel density estimation (KDE)
-    ax = scatter_matrix(master[list],
-                        color="#0392cf", alpha=0.5, figsize=(10, 10), diagonal='kde', marker='.')
+    plt = pyplot()
+    # diagonal is graphed by kernel density estimation (KDE), only the lower triangle is drawn
+    fig = plt.figure(figsize=(10, 10))
+    axes = scatter_matrix_lower(fig, master, list)
 
-    for i in range(np.shape(ax)[0]):
-        for j in range(np.shape(ax)[1]):
-            if i < j:
-                ax[i, j].set_visible(False)
-
-    for ax in ax.ravel():
+    for ax in axes[axes != None]:
         ax.set_xlabel(ax.get_xlabel().replace(' ', '\n'), fontsize=7, rotation=90, weight='medium')
         ax.set_ylabel(ax.get_ylabel().replace(' ', '\n'), fontsize=7, rotation=90, weight='medium')
-        ax.yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
         ax.yaxis.set_ticks([])
         ax.xaxis.set_ticks([])
 
-    plt.suptitle('Correlation plot of Initial Data', size=15, weight='bold', va='bottom', x=0.5, y=0.93)
-
-    handles = [plt.plot([], [], color=plt.cm.brg(i / 2.), ls="", marker="o",markersize=np.sqrt(10))[0] for i in range(3)]
-    handles = [handles[0], handles[2], handles[1]]
-    plt.savefig(dir)
-    plt.clf()
+    fig.suptitle('Correlation plot of Initial Data', size=15, weight='bold', va='bottom', x=0.5, y=0.93)
+    fig.savefig(dir)
+    plt.close(fig)
     return 0
 
 # Function to create correlation matrix
 def correlation_matrix(master, list,dir):
+    import seaborn as sns
+    plt = pyplot()
     corr_matrix = master[list]
     np.bool = np.bool_
     corr = round(corr_matrix.corr(), 2)
@@ -134,45 +687,430 @@ def correlation_matrix(master, list,dir):
     mask = np.zeros_like(corr, dtype=np.bool)
     mask[np.triu_indices_from(mask)] = True
 
+    heat_map, ax = plt.subplots(figsize=(10, 6))
     sns.heatmap(corr, annot_kws={'size': 10}, cmap='vlag_r', xticklabels=corr.columns.values,
-                yticklabels=corr.columns.values, annot=True, mask=mask)
-    heat_map = plt.gcf()
-    heat_map.set_size_inches(10, 6)
-    plt.suptitle('Correlation Matrix of Initial Data', size=15, weight='bold', va='bottom', x=0.5, y=0.93)
-    plt.xticks(fontsize=10)
-    plt.yticks(fontsize=10, rotation=0)
-    plt.savefig(dir)
-    plt.clf()
+                yticklabels=corr.columns.values, annot=True, mask=mask, ax=ax)
+    heat_map.suptitle('Correlation Matrix of Initial Data', size=15, weight='bold', va='bottom', x=0.5, y=0.93)
+    ax.tick_params(axis='x', labelsize=10)
+    ax.tick_params(axis='y', labelsize=10, labelrotation=0)
+    heat_map.savefig(dir)
+    plt.close(heat_map)
     return 0
 
+# Function to build the lag matrix once: column 0 is col itself, column k is col shifted by k
+def lag_matrix(master, nlag, col):
+    values = master[col].to_numpy(dtype=float)
+    lags = np.full((len(values), nlag + 1), np.nan)
+    for k in range(nlag + 1):
+        lags[k:, k] = values[:len(values) - k]
+    return lags
+
 # Function to run regression with different lags
-def ols_regression_lag(master,nlag, col):
-    R2_result = []
-    prevR2 = 0
+# Each lag set regresses UNRATE on col and lag_1..lag_i (no constant) over the rows where all lags exist,
+# which is the statsmodels OLS fit of the original loop. Instead of refitting, the normal equations are
+# accumulated from the last row upwards so every lag set reuses the cross products of the previous one.
+@profiled('ols')
+def ols_regression_lag(master, nlag, col):
+    x = lag_matrix(master, nlag, col)
+    y = master['UNRATE'].to_numpy(dtype=float)
+    x_filled = np.nan_to_num(x)
+
+    # Cross products over the rows where every lag exists, then add rows back one at a time
+    xtx = x_filled[nlag:].T @ x_filled[nlag:]
+    xty = x_filled[nlag:].T @ y[nlag:]
+    yty = y[nlag:] @ y[nlag:]
+
+    R2_by_lag = {}
+    for i in range(nlag, 0, -1):
+        gram = xtx[:i + 1, :i + 1]
+        scale = np.sqrt(np.diag(gram))
+        beta = np.linalg.solve(gram / np.outer(scale, scale), xty[:i + 1] / scale)
+        # Uncentered R2, as statsmodels reports for a regression without constant
+        R2_by_lag[i] = beta @ (xty[:i + 1] / scale) / yty
+        row = x_filled[i - 1]
+        xtx = xtx + np.outer(row, row)
+        xty = xty + row * y[i - 1]
+        yty = yty + y[i - 1] ** 2
+
+    R2 = np.array([R2_by_lag[i] for i in range(1, nlag + 1)])
+    R2_df = pd.DataFrame({'Total Lag': np.arange(1, nlag + 1),
+                          'R2': R2,
+                          'Change in R2': np.diff(R2, prepend=0)})
+    return R2_df
 
+# Function to run the lag regression of ols_regression_lag as of many dates from one expanding pass
+# The normal equations are running sums over rows, so each date adds only the rows since the previous date,
+# and the rows before a lag set's first usable row are removed by subtracting the prefix sums up to it
+def expanding_ols_regression_lag(master, nlag, col, as_of_dates):
+    x = np.nan_to_num(lag_matrix(master, nlag, col))
+    y = master['UNRATE'].to_numpy(dtype=float)
+    positions = as_of_positions(master.index, as_of_dates)
+
+    # Prefix sums up to row i, the first row of lag set i
+    head_xtx, head_xty, head_yty = [], [], []
+    xtx, xty, yty = np.zeros((nlag + 1, nlag + 1)), np.zeros(nlag + 1), 0.0
+    for i in range(nlag + 1):
+        head_xtx.append(xtx.copy())
+        head_xty.append(xty.copy())
+        head_yty.append(yty)
+        if i < len(y):
+            xtx = xtx + np.outer(x[i], x[i])
+            xty = xty + x[i] * y[i]
+            yty = yty + y[i] ** 2
+
+    results = {}
+    order = np.argsort(positions, kind='stable')
+    xtx, xty, yty, done = np.zeros((nlag + 1, nlag + 1)), np.zeros(nlag + 1), 0.0, 0
+    for k in order:
+        end = positions[k]
+        if end > done:
+            xtx = xtx + x[done:end].T @ x[done:end]
+            xty = xty + x[done:end].T @ y[done:end]
+            yty = yty + y[done:end] @ y[done:end]
+            done = end
+
+        results[as_of_dates[k]] = regression_from_sums(xtx, xty, yty, head_xtx, head_xty, head_yty, nlag, end)
+    return results
+
+# Function to solve the lag regressions from running sums of the normal equations over the first end rows
+# head_*[i] hold the sums over the rows before the first usable row of lag set i, which are taken out
+def regression_from_sums(xtx, xty, yty, head_xtx, head_xty, head_yty, nlag, end):
+    R2 = np.full(nlag, np.nan)
     for i in range(1, nlag + 1):
-        master_loop = master.copy()
-        column_names = [col]
-        current_lag = i
-        while i > 0:
-            text = 'lag' + '_' + str(i)
-            master_loop[text] = master_loop[col].shift(i)
-            column_names.append(text)
-            i = i - 1
-        master_loop = master_loop.dropna()
-
-        x = master_loop[column_names]
-        reg_model = sm.OLS(master_loop['UNRATE'], x)
-        result = reg_model.fit()
-        changeR2 = result.rsquared - prevR2
-        prevR2 = result.rsquared
-        R2_result.append({'Total Lag': current_lag, 'R2': result.rsquared, 'Change in R2': changeR2})
-
-    R2_df = pd.DataFrame(R2_result)
-    return R2_df
+        if end - i < i + 1:
+            continue
+        gram = (xtx - head_xtx[i])[:i + 1, :i + 1]
+        cross = (xty - head_xty[i])[:i + 1]
+        scale = np.sqrt(np.diag(gram))
+        try:
+            beta = np.linalg.solve(gram / np.outer(scale, scale), cross / scale)
+        except np.linalg.LinAlgError:
+            continue
+        R2[i - 1] = beta @ (cross / scale) / (yty - head_yty[i])
+    return pd.DataFrame({'Total Lag': np.arange(1, nlag + 1),
+                         'R2': R2,
+                         'Change in R2': np.diff(R2, prepend=0)})
+
+# Function to solve a stack of normal equations, a window whose system is singular gets NaN coefficients
+def solve_normal_equations(grams, crosses):
+    try:
+        return np.linalg.solve(grams, crosses[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        betas = np.full(crosses.shape, np.nan)
+        for t in range(len(grams)):
+            try:
+                betas[t] = np.linalg.solve(grams[t], crosses[t])
+            except np.linalg.LinAlgError:
+                continue
+        return betas
+
+# Function to solve a stack of regressions without constant from their normal equations (gram, cross, yty)
+# Returns the uncentered R2, as statsmodels reports for a regression without constant, and the coefficients
+def batched_r2(grams, crosses, ytys):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.sqrt(np.einsum('tjj->tj', grams))
+        rhs = crosses / scale
+        beta = solve_normal_equations(grams / (scale[:, :, None] * scale[:, None, :]), rhs)
+        return np.einsum('tj,tj->t', beta, rhs) / ytys, beta / scale
+
+# Function to build the cumulative normal equations of consecutive rows, entry k sums the first k rows
+def cumulative_normal_equations(x, y):
+    def cumulative(values):
+        return np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+    return cumulative(np.einsum('ri,rj->rij', x, x)), cumulative(x * y[:, None]), cumulative(y * y)
+
+# Function to build the normal equations (grams, crosses, ytys) of the windows ending at the sorted rows ends
+# The first window is summed from scratch, the later ones add the rows that entered and subtract the rows that
+# left, so rounding only accumulates within one chunk of ends.
+def window_normal_equations(x, y, ends, window, expanding=False):
+    first, last = ends[0], ends[-1]
+    start = 0 if expanding else first - window
+    offsets = ends - first
+    added_xtx, added_xty, added_yty = cumulative_normal_equations(x[first:last], y[first:last])
+    grams = x[start:first].T @ x[start:first] + added_xtx[offsets]
+    crosses = x[start:first].T @ y[start:first] + added_xty[offsets]
+    ytys = y[start:first] @ y[start:first] + added_yty[offsets]
+    if not expanding:
+        left = slice(start, start + last - first)
+        removed_xtx, removed_xty, removed_yty = cumulative_normal_equations(x[left], y[left])
+        grams -= removed_xtx[offsets]
+        crosses -= removed_xty[offsets]
+        ytys -= removed_yty[offsets]
+    return grams, crosses, ytys
+
+# Function to compute the uncentered R2 of every leading block of a stack of normal equations at once
+# The Cholesky factor of a leading block is the leading block of the full factor, so with G = L L' and
+# z = L^-1 cross the R2 of the first k regressors is the sum of the first k z**2 over yty. A stack with a
+# singular window falls back to solving each leading block with batched_r2.
+def nested_r2(grams, crosses, ytys):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.sqrt(np.einsum('tjj->tj', grams))
+        rhs = crosses / scale
+        try:
+            factor = np.linalg.cholesky(grams / (scale[:, :, None] * scale[:, None, :]))
+        except np.linalg.LinAlgError:
+            return np.stack([batched_r2(grams[:, :k, :k], crosses[:, :k], ytys)[0]
+                             for k in range(1, grams.shape[1] + 1)], axis=1)
+        return np.cumsum(np.linalg.solve(factor, rhs[..., None])[..., 0] ** 2, axis=1) / ytys[:, None]
+
+# Function to run the lag regressions of ols_regression_lag on rolling windows of window rows, every step rows
+# expanding=True keeps the first row fixed, so the window grows from window rows to the full sample
+# Only rows where all nlag lags exist are used, so every lag set of a window is fitted on the same rows.
+# The windows are solved in chunks spanning ROLLING_CHUNK rows, so memory does not grow with the number of
+# windows. Within a chunk the normal equations slide (see window_normal_equations).
+# Returns the R2 of every lag set (columns Total Lag) and the coefficients of the nlag model, indexed by the
+# last date of each window
+def rolling_ols_regression_lag(master, nlag, col, window=ROLLING_WINDOW, step=ROLLING_STEP, expanding=False):
+    x = np.nan_to_num(lag_matrix(master, nlag, col))[nlag:]
+    y = master['UNRATE'].to_numpy(dtype=float)[nlag:]
+    ends = np.arange(window, len(y) + 1, step)
+
+    R2 = np.full((len(ends), nlag), np.nan)
+    coefficients = np.full((len(ends), nlag + 1), np.nan)
+    size = max(1, ROLLING_CHUNK // step)
+    for first in range(0, len(ends), size):
+        rows = slice(first, first + size)
+        grams, crosses, ytys = window_normal_equations(x, y, ends[rows], window, expanding)
+        R2[rows] = nested_r2(grams, crosses, ytys)[:, 1:]
+        coefficients[rows] = batched_r2(grams, crosses, ytys)[1]
+
+    index = master.index[nlag:][ends - 1]
+    return {
+        'R2': pd.DataFrame(R2, index=index, columns=pd.Index(np.arange(1, nlag + 1), name='Total Lag')),
+        'coefficients': pd.DataFrame(coefficients, index=index,
+                                     columns=[col] + ['lag_' + str(k) for k in range(1, nlag + 1)]),
+    }
+
+# Function to find, for every window of a rolling regression, the lag that adds the most R2
+def rolling_largest_change_lag(R2):
+    change = R2.diff(axis=1)
+    change[R2.columns[0]] = R2[R2.columns[0]]
+    return change.idxmax(axis=1, skipna=True).where(change.notna().any(axis=1))
+
+# Function to draw moving block bootstrap resamples of n rows as row weights (resamples x n)
+# Each resample chains blocks of block consecutive rows starting at random rows, a row drawn twice weighs 2
+def block_bootstrap_weights(rng, n, resamples, block=BOOTSTRAP_BLOCK):
+    block = max(1, min(block, n))
+    starts = rng.integers(0, n - block + 1, size=(resamples, -(-n // block)))
+    rows = (starts[:, :, None] + np.arange(block)).reshape(resamples, -1)[:, :n]
+    rows = rows + np.arange(resamples)[:, None] * n
+    return np.bincount(rows.ravel(), minlength=resamples * n).reshape(resamples, n).astype(float)
+
+# Function to build the terms of the bootstrap that do not depend on the resample, once per run for every chunk
+# outer holds the products of each lag matrix row (for the weighted normal equations), ma the valid mask, values
+# and squares of the moving averages (for the weighted correlation sums)
+def bootstrap_terms(x, ma):
+    valid = ~np.isnan(ma)
+    filled = np.where(valid, ma, 0.0)
+    return {
+        'outer': (x[:, :, None] * x[:, None, :]).reshape(len(x), -1),
+        'ma': np.concatenate([valid, filled, filled * filled], axis=1),
+    }
+
+# Function to compute the R2 of every lag set of ols_regression_lag for a stack of row weights (resamples x n)
+# x is the lag matrix with NaN as 0 and outer its row products. Lag set i uses the rows from row i on, so the
+# weighted sums of the rows before it are taken out as in regression_from_sums.
+def weighted_lag_r2(x, y, outer, weights, nlag):
+    xtx = (weights @ outer).reshape(len(weights), x.shape[1], x.shape[1])
+    xty = (weights * y) @ x
+    yty = weights @ (y * y)
+    head = weights[:, :nlag]
+    head_xtx = np.cumsum(head[:, :, None, None] * (x[:nlag, :, None] * x[:nlag, None, :]), axis=1)
+    head_xty = np.cumsum(head[:, :, None] * (x[:nlag] * y[:nlag, None]), axis=1)
+    head_yty = np.cumsum(head * y[:nlag] ** 2, axis=1)
+
+    R2 = np.full((len(weights), nlag), np.nan)
+    for i in range(1, nlag + 1):
+        R2[:, i - 1] = batched_r2((xtx - head_xtx[:, i - 1])[:, :i + 1, :i + 1],
+                                  (xty - head_xty[:, i - 1])[:, :i + 1], yty - head_yty[:, i - 1])[0]
+    return R2
+
+# Function to compute the correlation grid of correlation_grid for a stack of row weights (resamples x rows)
+# The weight of row r applies to the pair of the moving averages at row r, so one draw serves every lag.
+# ma_terms is bootstrap_terms()['ma'], the sums of lag_correlation_sums come from three products per lag.
+def weighted_correlation_grid(ma_terms, y, lags, weights):
+    width = ma_terms.shape[1] // 3
+    grids = np.full((len(weights), width, len(lags)), np.nan)
+    for j, lag in enumerate(lags):
+        if lag >= len(y):
+            continue
+        rows = len(y) - lag
+        w = weights[:, :rows]
+        wy = w * y[lag:]
+        count, sx, sxx = np.split(w @ ma_terms[:rows], 3, axis=1)
+        sy, sxy = np.split(wy @ ma_terms[:rows, :2 * width], 2, axis=1)
+        syy = (wy * y[lag:]) @ ma_terms[:rows, :width]
+        grids[:, :, j] = correlation_from_sums(count, sx, sy, sxx, syy, sxy)
+    return grids
+
+# Function to run one chunk of bootstrap resamples from its own seed, module level so it can run on a pool
+def bootstrap_chunk(seed, resamples, x, y, terms, nlag, lags, block):
+    weights = block_bootstrap_weights(np.random.default_rng(seed), len(y), resamples, block)
+    return (weighted_lag_r2(x, y, terms['outer'], weights, nlag),
+            weighted_correlation_grid(terms['ma'], y, lags, weights))
+
+# Function to compute sum over r of a[r, c] * b[(r + s) % m] for every circular shift s (rows) and column c
+def circular_cross_sums(a, b):
+    return np.fft.irfft(np.conj(np.fft.rfft(a, axis=0)) * np.fft.rfft(b)[:, None], len(b), axis=0)
+
+# Function to pick the circular shifts of m rows used as permutations, far enough from the observed alignment
+# fractions (uniform in [0, 1)) are mapped onto the allowed shifts, when there are fewer of them all are used
+def permutation_shifts(m, fractions, min_shift=PERMUTATION_MIN_SHIFT):
+    count = m - 2 * min_shift + 1
+    if count <= len(fractions):
+        return np.arange(min_shift, m - min_shift + 1)
+    return min_shift + (fractions * count).astype(int)
+
+# Function to compute permutation p-values of the correlation grid
+# The null rotates UNRATE against the moving averages, which keeps the autocorrelation of both series.
+# Rotating only changes the sums involving UNRATE, which FFTs give for every shift at once, and only the
+# drawn shifts are turned into correlations.
+# x and valid come from correlation_inputs.
+def permutation_correlation_p_values(x, valid, y, lags, fractions, min_shift=PERMUTATION_MIN_SHIFT):
+    p_values = np.full((x.shape[1], len(lags)), np.nan)
+    for j, lag in enumerate(lags):
+        rows = len(y) - lag
+        shifts = permutation_shifts(rows, fractions, min_shift)
+        if len(shifts) == 0:
+            continue
+        sums = lag_correlation_sums(x, valid, y, lag)
+        observed = correlation_from_sums(*sums)
+        count, sx, sxx = sums[0], sums[1], sums[3]
+        y_lag = y[lag:]
+        null = correlation_from_sums(count, sx, circular_cross_sums(valid[:rows], y_lag)[shifts], sxx,
+                                     circular_cross_sums(valid[:rows], y_lag * y_lag)[shifts],
+                                     circular_cross_sums(x[:rows], y_lag)[shifts])
+        p_values[:, j] = np.where(np.isnan(observed), np.nan,
+                                  (1 + (np.abs(null) >= np.abs(observed)).sum(axis=0)) / (1 + len(shifts)))
+    return p_values
+
+# Function to compute permutation p-values of the R2 of every lag set, rotating UNRATE against the lag matrix
+# The gram matrix does not change with the rotation, only the cross products, taken from FFTs
+def permutation_r2_p_values(x, y, R2, nlag, fractions, min_shift=PERMUTATION_MIN_SHIFT):
+    p_values = np.full(nlag, np.nan)
+    for i in range(1, nlag + 1):
+        x_set, y_set = x[i:, :i + 1], y[i:]
+        shifts = permutation_shifts(len(y_set), fractions, min_shift)
+        if len(shifts) == 0 or np.isnan(R2[i - 1]):
+            continue
+        grams = np.broadcast_to(x_set.T @ x_set, (len(shifts), i + 1, i + 1))
+        null = batched_r2(grams, circular_cross_sums(x_set, y_set)[shifts], np.full(len(shifts), y_set @ y_set))[0]
+        p_values[i - 1] = (1 + (null >= R2[i - 1]).sum()) / (1 + len(shifts))
+    return p_values
+
+# Function to attach block bootstrap confidence intervals and permutation p-values to the R2 of every lag set
+# of ols_regression_lag and to every (MA window x lag) correlation of correlation_grid
+# The resamples are split in chunks seeded from one SeedSequence, each chunk evaluates all its resamples as
+# batched matrix products (weighted normal equations and correlation sums), jobs > 1 runs them on a pool
+@profiled('significance')
+def significance_tests(master, nlag=24, col='house_diff', windows=CORR_GRID_WINDOWS, lags=CORR_GRID_LAGS,
+                       resamples=BOOTSTRAP_RESAMPLES, block=BOOTSTRAP_BLOCK, seed=BOOTSTRAP_SEED, jobs=1,
+                       confidence=CONFIDENCE_LEVEL):
+    windows = list(windows)
+    lags = list(lags)
+    x = np.nan_to_num(lag_matrix(master, nlag, col))
+    y = master['UNRATE'].to_numpy(dtype=float)
+    ma = moving_average_matrix(master[col].to_numpy(), windows)
+    terms = bootstrap_terms(x, ma)
+
+    sizes = [min(BOOTSTRAP_CHUNK, resamples - start) for start in range(0, resamples, BOOTSTRAP_CHUNK)]
+    permutation_seed, *seeds = np.random.SeedSequence(seed).spawn(len(sizes) + 1)
+    tasks = [(task_seed, size, x, y, terms, nlag, lags, block) for task_seed, size in zip(seeds, sizes)]
+    if jobs <= 1 or len(tasks) <= 1:
+        chunks = [bootstrap_chunk(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+            chunks = list(executor.map(bootstrap_chunk, *zip(*tasks)))
+    R2_samples = np.concatenate([R2 for R2, grids in chunks])
+    grid_samples = np.concatenate([grids for R2, grids in chunks])
+
+    tail = (1 - confidence) / 2
+    with np.errstate(invalid='ignore'):
+        R2_low, R2_high = np.nanquantile(R2_samples, [tail, 1 - tail], axis=0)
+        grid_low, grid_high = np.nanquantile(grid_samples, [tail, 1 - tail], axis=0)
+    R2 = weighted_lag_r2(x, y, terms['outer'], np.ones((1, len(y))), nlag)[0]
+    fractions = np.random.default_rng(permutation_seed).random(PERMUTATION_SHIFTS)
+
+    def grid_frame(values):
+        return pd.DataFrame(values, index=pd.Index(windows, name='MA Window'), columns=pd.Index(lags, name='Lag'))
+
+    return {
+        'regression': pd.DataFrame({'Total Lag': np.arange(1, nlag + 1),
+                                    'R2': R2,
+                                    'CI Low': R2_low,
+                                    'CI High': R2_high,
+                                    'P-Value': permutation_r2_p_values(x, y, R2, nlag, fractions)}),
+        'correlation_ci_low': grid_frame(grid_low),
+        'correlation_ci_high': grid_frame(grid_high),
+        'correlation_p_value': grid_frame(permutation_correlation_p_values(*correlation_inputs(ma), y, lags,
+                                                                           fractions)),
+        'resamples': resamples,
+        'block': block,
+        'confidence': confidence,
+    }
+
+# Function to key the significance tests by the data they resample, every setting that changes their result and
+# the source of this module (jobs does not change the seeded result)
+def significance_key(master, nlag, col, resamples):
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(master[['UNRATE', col]], index=True).to_numpy().tobytes())
+    digest.update(json.dumps([nlag, col, resamples, BOOTSTRAP_BLOCK, BOOTSTRAP_SEED, BOOTSTRAP_CHUNK, CONFIDENCE_LEVEL,
+                              PERMUTATION_SHIFTS, PERMUTATION_MIN_SHIFT, list(CORR_GRID_WINDOWS),
+                              list(CORR_GRID_LAGS)]).encode())
+    digest.update(module_source_hash(__name__).encode())
+    return digest.hexdigest()
+
+# Function to run the significance tests of an analysis, None when they are skipped: resamples=0 or inputs
+# longer than SIGNIFICANCE_MAX_ROWS. cache_dir keeps the result of the last call (as adf.json), so a rerun on
+# the same data and settings reads it instead of resampling again
+def analysis_significance(master, nlag=24, col='house_diff', resamples=BOOTSTRAP_RESAMPLES, jobs=1, cache_dir=None):
+    if not resamples or len(master) > SIGNIFICANCE_MAX_ROWS:
+        return None
+    if cache_dir is None:
+        return significance_tests(master, nlag, col, resamples=resamples, jobs=jobs)
+    key = significance_key(master, nlag, col, resamples)
+    cache_path = cache_dir + 'significance.pkl'
+    if os.path.exists(cache_path):
+        stored = pd.read_pickle(cache_path)
+        if stored['key'] == key:
+            return stored['result']
+    result = significance_tests(master, nlag, col, resamples=resamples, jobs=jobs)
+    # Written to a temp file first, the rename is atomic so a concurrent reader never sees half a result
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = cache_path + '.' + str(os.getpid()) + '.' + str(threading.get_ident())
+    pd.to_pickle({'key': key, 'result': result}, temp_path)
+    os.replace(temp_path, cache_path)
+    return result
+
+# Function to plot the R2 of the full lag model and the lag adding the most R2 over rolling windows
+def rolling_regression_plot(R2, events, dir):
+    plt = pyplot()
+    fig, ax1 = plt.subplots(figsize=(18, 6))
+    ax1.plot(R2.index, R2[R2.columns[-1]].to_numpy(), color='tab:red', label='R2 with ' + str(R2.columns[-1]) + ' lags')
+    ax1.set_xlabel('Last month of the window', fontdict={'fontsize': 15, 'fontweight': 'medium'})
+    ax1.set_ylabel('R square', fontdict={'fontsize': 15, 'fontweight': 'medium'})
+    ax1.set_title('Rolling regression of unemployment on lagged house price changes',
+                  fontdict={'fontsize': 20, 'fontweight': 'medium'})
+    ax1.grid(True)
+
+    ax2 = ax1.twinx()
+    largest_change = rolling_largest_change_lag(R2)
+    ax2.step(largest_change.index, largest_change.to_numpy(dtype=float), where='post', color='tab:gray', alpha=0.7,
+             label='Lag adding the most R2')
+    ax2.set_ylabel('Lag (months)', size=15)
+    lines = ax1.get_lines() + ax2.get_lines()
+    ax1.legend(lines, [line.get_label() for line in lines], loc='upper left')
+    add_event_layer(ax1, events, R2.index, kinds=('recession',))
+
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    fig.savefig(dir)
+    plt.close(fig)
+    return 0
 
 # Function to Create regression plot with different lags
 def regression_plot(R2_df, dir):
+    plt = pyplot()
     fig, ax1 = plt.subplots(figsize=(6, 6))
     ax1.plot('Total Lag', 'R2', data=R2_df, color='tab:red', label='R square')
     ax1.set_xlabel('Lags', fontdict={'fontsize': 15, 'fontweight': 'medium'})
@@ -189,291 +1127,437 @@ def regression_plot(R2_df, dir):
     # axes up to make room for them
     fig.autofmt_xdate()
     fig.tight_layout()  # otherwise the right y-label is slightly clipped
-    plt.savefig(dir)
-    plt.clf()
+    fig.savefig(dir)
+    plt.close(fig)
     return 0
 
 # Function to Create a time series graph after applying lags
-def timeseries_recession_graph_after(master, dir):
-    master['house_lag12'] = master['house_12MA'].shift(12)
+def timeseries_recession_graph_after(master, window, lag, events, dir):
+    plt = pyplot()
+    house_lagged = downsample_series(master[ma_column(window)].shift(lag))
+    unrate = downsample_series(master['UNRATE'])
     fig, ax1 = plt.subplots(figsize=(18, 8))
-    ax1.plot(master.index, 'UNRATE', data=master, color='tab:blue', label='UNRATE')
+    ax1.plot(unrate.index, unrate.to_numpy(), color='tab:blue', label='UNRATE')
     ax1.set_xlabel('Year', fontdict={'fontsize': 15, 'fontweight': 'medium'})
     ax1.set_ylabel('Unemploymet Rate %', fontdict={'fontsize': 15, 'fontweight': 'medium'})
     ax1.set_title('Unemploymet Rate Over Time', fontdict={'fontsize': 20, 'fontweight': 'medium'})
     ax1.grid(True)
 
     ax2 = ax1.twinx()
-    ax2.plot(master.index, 'house_lag12', data=master, color='tab:grey', alpha=0.5, label='lag 12')
+    ax2.plot(house_lagged.index, house_lagged.to_numpy(), color='tab:grey', alpha=0.5, label='lag ' + str(lag))
     ax2.tick_params(axis='y')  # ,labelcolor = color)
     ax2.set_ylabel('Return in Median House Sales Price', size=15)
-    plt.legend(loc='upper left')
+    ax2.legend(loc='upper left')
 
     # Year break is unemployment peak or trough
-    ax3 = ax1.twinx()
-    break_year = np.datetime64(date(1971, 10, 1).strftime('%Y-%m-%d'))
-    ax3.axvline(break_year, ls='--', color='r', alpha=0.5)
-    ax3.axis('off')
-
-    ax4 = ax1.twinx()
-    break_year = np.datetime64(date(1975, 6, 1).strftime('%Y-%m-%d'))
-    ax4.axvline(break_year, ls='--', color='r', alpha=0.5)
-    ax4.axis('off')
-
-    ax5 = ax1.twinx()
-    break_year = np.datetime64(date(1982, 12, 1).strftime('%Y-%m-%d'))
-    ax5.axvline(break_year, ls='--', color='r', alpha=0.5)
-    ax5.axis('off')
-
-    ax6 = ax1.twinx()
-    break_year = np.datetime64(date(1992, 6, 1).strftime('%Y-%m-%d'))
-    ax6.axvline(break_year, ls='--', color='r', alpha=0.5)
-    ax6.axis('off')
-
-    ax7 = ax1.twinx()
-    break_year = np.datetime64(date(2009, 11, 1).strftime('%Y-%m-%d'))
-    ax7.axvline(break_year, ls='--', color='r', alpha=0.5)
-    ax7.axis('off')
-
-    ax8 = ax1.twinx()
-    break_year = np.datetime64(date(2023, 2, 1).strftime('%Y-%m-%d'))
-    ax8.axvline(break_year, ls='--', color='r', alpha=0.5)
-    ax8.axis('off')
+    add_event_layer(ax1, events, master.index, kinds=('break',))
 
     # rotates and right aligns the x labels, and moves the bottom of the
     # axes up to make room for them
     fig.autofmt_xdate()
     fig.tight_layout()  # otherwise the right y-label is slightly clipped
-    plt.savefig(dir)
-    plt.clf()
+    fig.savefig(dir)
+    plt.close(fig)
     return 0
 
-# Function to Create a LaTeX document with latex code
-def generate_latex_report(df,df2, image_path, report_path):
-    latex_code = r'''
-\documentclass[twocolumn,12pt]{article}
-\usepackage[left=1.5cm, right=1.5cm, bottom=2cm, top=2cm]{geometry}
-\usepackage[utf8]{inputenc}
-\usepackage{mathptmx}
-\usepackage{fancyhdr}
-\usepackage{latexsym}
-\usepackage{booktabs,chemformula}
-\usepackage{multirow,array}
-\usepackage{multicol}
-\usepackage{natbib}
-\usepackage{graphicx}
-\usepackage{colortbl}
-\usepackage{indentfirst}
-\usepackage{amsmath}
-\usepackage[english]{babel}
-\usepackage[capposition=top]{floatrow}
-
-\usepackage[compact]{titlesec}
-\titlespacing{\section}{1pt}{2ex}{2ex}
-\titlespacing{\subsection}{1pt}{1ex}{1ex}
-
-\definecolor{indigo(dye)}{rgb}{0.0, 0.25, 0.42}
-\definecolor{lightgreen}{rgb}{0.56, 0.93, 0.56}
-\definecolor{lightpink}{rgb}{1.0, 0.71, 0.76}
-\definecolor{lightyellow}{rgb}{0.98, 0.98, 0.82}
-
-\setlength{\parindent}{20pt}
-\setlength{\parskip}{\baselineskip}
-
-\let\oldheadrule\headrule% Copy \headrule into \oldheadrule
-\renewcommand{\headrule}{\color{indigo(dye)}\oldheadrule}
-\pagestyle{fancy}
-\fancyhf{}
-\rhead{\thepage}
-\lhead{\textcolor{indigo(dye)}{US Unemployment Rate VS. Median House Sale Price in the US.}}
-
-\usepackage{titling}
-\setlength{\droptitle}{-1cm}
-
-\begin{document}
-
-\title{\textbf{\textcolor{indigo(dye)}{Relationship between the US Unemployment Rate and Median House Sale Price in the US.}}}
-\author{\textbf{\textcolor{indigo(dye)}{Hanlu Xia}}}
-\date{\textbf{\textcolor{indigo(dye)}{Dec 1, 2024}}}
-\maketitle
-
-\section*{\textcolor{indigo(dye)}{Introduction}}
-
-Unemployment is an important indicators used to explain US economy performance, and it is proved to be highly correlated to recession. On the other hand, Housing market is always involved either directly or indirectly in US recession, especially in 2008.
-
-This analysis wants to explore whether housing price can be used an a predictor to US recession (using umeployment rate to represent the recession cycle). They are very likely to have a negative correlation as housing market usually goes down when unemployment goes up. It's also very likely there would be lagging effects between the two, as housing market usually starts to go down before umemployment starts to go up. If there are measurable lags, how many months would that be?
-
-\section*{\textcolor{indigo(dye)}{Exploratory Analysis}}
-This shows the Time Series Plot of Raw data, and the stationary analysis of raw data and their first difference.
-
-\begin{figure*}[ht]
-\centering
-\includegraphics[width=1\textwidth]{'''+ image_path + '''timeseries1.png}
-\caption{Unemployment Vs. House Price}
-\end{figure*}
-
-The following table represents the stationary analysis:
-
-
-\\begin{table}[H]
-\scalebox{0.8}{
-\\begin{tabular}{@{} l*{3}{>{}c<{}} @{}}
-\\toprule
-Description & P-Value & Result & \\\\
-\midrule
-''' + generate_dataframe_latex(df,['Description','P-Value','Result']) + r'''
-\bottomrule
-\end{tabular}}
-\caption{Stationary Analysis}
-\end{table}
-
-\subsection*{\textcolor{indigo(dye)}{Correlation Analysis of Raw data and First Difference}}
-
-Some text to fill here; Some text to fill here; Some text to fill here; Some text to fill here; Some text to fill here; 
-
-\begin{figure}[H]
-\centering
-\includegraphics[width=1\textwidth]{'''+ image_path + '''correlationplot1.png}
-\caption{Correlation Plot of Raw data and First Difference }
-\end{figure}
-
-\\begin{figure}[H]
-\centering
-\scalebox{1}{
-\includegraphics[width=1\\textwidth]{'''+ image_path + '''corrmatrix1.png}}
-\caption{Correlation Matrix of Raw data and First Difference}
-\end{figure}
-
-\section*{\\textcolor{indigo(dye)}{Regression Analysis}}
-
-Some text to fill here; Some text to fill here; Some text to fill here; Some text to fill here; Some text to fill here; 
-
-\\begin{table}[H]
-\scalebox{1}{
-\\begin{tabular}{@{} l*{3}{>{}c<{}} @{}}
-\\toprule
-Total Lag & R2 & Change in R2 & \\\\
-\midrule
-''' + generate_dataframe_latex(df2,['Total Lag','R2','Change in R2']) + r'''
-\bottomrule
-\end{tabular}}
-\caption{Regression and Lags}
-\label{market_crash}
-\end{table}
-
-\begin{figure}[H]
-\centering
-\includegraphics[width=1\textwidth]{'''+ image_path + '''regression_result.png}
-\caption{Change in R2 Over Lags}
-\end{figure}
-
-
-\section*{\\textcolor{indigo(dye)}{Correlation with Optimized Lag}}
-
-Some text to fill here; Some text to fill here; Some text to fill here; Some text to fill here; Some text to fill here; 
-
-\\begin{figure*}[h!]
-\centering
-\includegraphics[width=1\\textwidth]{'''+ image_path + '''correlationplot2.png}
-\caption{Correlation Plot After Lag}
-\end{figure*}
-
-\\begin{figure*}[h!]
-\centering
-\includegraphics[width=1\\textwidth]{'''+ image_path + '''corrmatrix2.png}
-\caption{Correlation Matrix After Lag}
-\end{figure*}
-
-\section*{\\textcolor{indigo(dye)}{Conclusion}}
-Based on analysis above, it is statistically confident enough to say that housing price is a predictor of the unemployment rate with 11 month lags.
+# Function to hash the source file of a module, read once per process (empty for modules without a file)
+@lru_cache(maxsize=None)
+def module_source_hash(module_name):
+    path = getattr(sys.modules.get(module_name), '__file__', None)
+    if path is None or not os.path.exists(path):
+        return ''
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+# Function to hash the inputs of a figure job together with the code of its plot function
+# The marshalled code object covers the constants (titles, sizes, colors) as well as the bytecode, and the
+# source of the plot function's module covers the helpers and module constants it uses
+def figure_key(plot_function, inputs):
+    digest = hashlib.sha256()
+    digest.update(plot_function.__name__.encode())
+    digest.update(marshal.dumps(plot_function.__code__))
+    digest.update(module_source_hash(plot_function.__module__).encode())
+    for item in inputs:
+        if isinstance(item, pd.DataFrame):
+            digest.update(json.dumps([str(col) for col in item.columns]).encode())
+            digest.update(pd.util.hash_pandas_object(item, index=True).to_numpy().tobytes())
+        else:
+            digest.update(json.dumps(item, default=str).encode())
+    return digest.hexdigest()
+
+# Function to reuse cached pngs for unchanged figure jobs, returns the jobs that still need rendering
+def cached_figure_jobs(figure_jobs, cache_dir, manifest):
+    to_render = []
+    for plot_function, inputs, output_path in figure_jobs:
+        key = figure_key(plot_function, inputs)
+        cached_path = cache_dir + key + '.png'
+        if manifest.get(output_path) == key and os.path.exists(output_path):
+            continue
+        if os.path.exists(cached_path):
+            shutil.copyfile(cached_path, output_path)
+            manifest[output_path] = key
+            continue
+        to_render.append((plot_function, inputs, output_path, key))
+    return to_render
+
+# Function to remove the cached pngs no output path of the manifest shows any more (older versions of a figure)
+# so the cache holds at most one png per figure file of the folder
+def prune_figure_cache(cache_dir, manifest):
+    keep = {key + '.png' for key in manifest.values()}
+    for name in os.listdir(cache_dir):
+        if name.endswith('.png') and name not in keep:
+            try:
+                os.remove(cache_dir + name)
+            except FileNotFoundError:
+                continue
+
+# Function to render a list of figure jobs, each job is (plot function, inputs, output path)
+# jobs > 1 renders them on a process pool, so a report takes roughly the time of its slowest plot
+# With a cache_dir, figures whose inputs did not change are copied from the cache instead of redrawn, and the
+# cached versions no figure uses any more are pruned
+@profiled('figures')
+def render_figures(figure_jobs, jobs=1, cache_dir=None):
+    manifest = {}
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        if os.path.exists(cache_dir + 'manifest.json'):
+            with open(cache_dir + 'manifest.json') as file:
+                manifest = json.load(file)
+        to_render = cached_figure_jobs(figure_jobs, cache_dir, manifest)
+    else:
+        to_render = [(plot_function, inputs, output_path, None) for plot_function, inputs, output_path in figure_jobs]
+
+    if jobs <= 1 or len(to_render) <= 1:
+        for plot_function, inputs, output_path, key in to_render:
+            with stage('figure:' + plot_function.__name__, file=os.path.basename(output_path)):
+                plot_function(*inputs, output_path)
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(to_render))) as executor:
+            futures = [executor.submit(plot_function, *inputs, output_path)
+                       for plot_function, inputs, output_path, key in to_render]
+            for future in futures:
+                future.result()
+
+    if cache_dir is not None:
+        for plot_function, inputs, output_path, key in to_render:
+            shutil.copyfile(output_path, cache_dir + key + '.png')
+            manifest[output_path] = key
+        with open(cache_dir + 'manifest.json', 'w') as file:
+            json.dump(manifest, file, indent=1)
+        prune_figure_cache(cache_dir, manifest)
+    return 0
 
-\\begin{figure*}[h!]
-\centering
-\includegraphics[width=1\\textwidth]{'''+ image_path + '''timeseries2.png}
-\caption{Unemployment Rate Vs. House Price with 11 lags}
-\end{figure*}
-
-
-\end{document}
-    '''
-    # Write the LaTeX code to a .tex file
+# Function to read the data driven lag of the moving average shown in the lagged time series graph
+# A window without any correlation falls back to the overall best lag, or no lag
+def optimal_lag(analysis, window=None):
+    grid = analysis['correlation_grid']
+    lag = grid['best_lag_by_window'].get(window or AFTER_MA_WINDOW)
+    if lag is None or pd.isna(lag):
+        lag = grid['best_lag'] if grid['best_lag'] is not None else 0
+    return int(lag)
+
+# Function to list the figures of the pdf report, only the columns each plot needs are passed to it
+def pdf_figure_jobs(analysis, dir):
+    master = analysis['master']
+    ma_master = analysis['ma_master']
+    first_corr = ['UNRATE', 'MSPNHSUS', 'house_diff', 'house_return']
+    first_matrix = ['UNRATE', 'house_diff', 'house_return']
+    second_corr = MA_CORR_COLUMNS
+    second_matrix = MA_CORR_COLUMNS
+    events = recession_events()
+    return [
+        (timeseries_recession_graph, (master[['UNRATE', 'MSPNHSUS']], events), dir + 'timeseries1.png'),
+        (correlation_plot, (master[first_corr], first_corr), dir + 'correlationplot1.png'),
+        (correlation_matrix, (master[first_matrix], first_matrix), dir + 'corrmatrix1.png'),
+        (regression_plot, (analysis['regression_result'],), dir + 'regression_result.png'),
+        (rolling_regression_plot, (analysis['rolling_regression']['R2'], events), dir + 'rolling_regression.png'),
+        (correlation_plot, (ma_master[second_corr], second_corr), dir + 'correlationplot2.png'),
+        (correlation_matrix, (ma_master[second_matrix], second_matrix), dir + 'corrmatrix2.png'),
+        (timeseries_recession_graph_after, (ma_master[['UNRATE', ma_column(AFTER_MA_WINDOW)]], AFTER_MA_WINDOW,
+                                            optimal_lag(analysis), events), dir + 'timeseries2.png'),
+    ]
+
+# Function to list the figures of the html report
+def html_figure_jobs(analysis, dir):
+    ma_master = analysis['ma_master']
+    second_corr = MA_CORR_COLUMNS
+    second_matrix = MA_CORR_COLUMNS
+    return [
+        (correlation_plot, (ma_master[second_corr], second_corr), dir + 'correlationplot2.png'),
+        (correlation_matrix, (ma_master[second_matrix], second_matrix), dir + 'corrmatrix2.png'),
+    ]
+
+# LaTeX template placeholders are written \VAR{name}, which cannot clash with LaTeX syntax such as @{}
+class LatexTemplate(Template):
+    delimiter = '\\VAR'
+
+# Function to read the LaTeX template of the report, read once per process
+@lru_cache(maxsize=None)
+def latex_template(name=LATEX_TEMPLATE):
+    with open(os.path.join(TEMPLATE_DIR, name)) as file:
+        return LatexTemplate(file.read())
+
+# Function to Create a LaTeX document from the report template
+@profiled('latex_template')
+def generate_latex_report(df,df2, image_path, report_path, lag=11, report_date='Dec 1, 2024',
+                          rolling_window=ROLLING_WINDOW, conclusion=''):
+    latex_code = latex_template().substitute(
+        report_date=report_date,
+        image_path=image_path,
+        stationary_table=generate_dataframe_latex(df, ['Description', 'P-Value', 'Result']),
+        regression_table=generate_dataframe_latex(df2, ['Total Lag', 'R2', 'Change in R2']),
+        lag=lag,
+        rolling_window=rolling_window,
+        conclusion=conclusion,
+    )
+    # Write the LaTeX code to a .tex file, an unchanged file is not rewritten so its mtime stays stable
+    if os.path.exists(report_path):
+        with open(report_path) as file:
+            if file.read() == latex_code:
+                return 0
     with open(report_path, 'w') as file:
         file.write(latex_code)
+    return 0
 
 # Function to convert a pandas DataFrame to LaTeX table format
+# Numeric-only tables print as floats, the same way the former row by row loop did
 def generate_dataframe_latex(df,list3):
-    latex_str = ""
-    df = df.round(3)
-    for index, row in df.iterrows():
-        latex_str += f"{row[list3[0]]} & {row[list3[1]]} & {row[list3[2]]}  \\\\\n"
-    return latex_str
+    df = df[list3].round(3)
+    if all(pd.api.types.is_numeric_dtype(df[col]) for col in list3):
+        df = df.astype(float)
+    rows = df[list3[0]].astype(str)
+    for col in list3[1:]:
+        rows = rows + ' & ' + df[col].astype(str)
+    return ''.join(rows + '  \\\\\n')
+
+# Function to write the conclusion of the pdf report for the moving average shown with its optimal lag
+# With significance tests the claim follows their permutation p-value and the lag regression intervals are
+# tabulated, without them the lead is only described
+def generate_conclusion_latex(analysis, window=None):
+    window = window or AFTER_MA_WINDOW
+    lag = optimal_lag(analysis, window)
+    lead = ('Based on analysis above, the ' + str(window) + '-month moving average of house price changes leads the '
+            'unemployment rate by ' + str(lag) + ' months, with a correlation of '
+            + '{:.3f}'.format(analysis['correlation_grid']['grid'].loc[window, lag]))
+    significance = analysis.get('significance')
+    if significance is None:
+        return lead + '. No significance tests were run for this report, so this lead is not tested.\n'
+
+    alpha = 1 - significance['confidence']
+    level = str(round(significance['confidence'] * 100)) + '\\%'
+    p_value = significance['correlation_p_value'].loc[window, lag]
+    regression = significance['regression']
+    text = (lead + ' (' + level + ' block bootstrap confidence interval '
+            + '{:.3f}'.format(significance['correlation_ci_low'].loc[window, lag]) + ' to '
+            + '{:.3f}'.format(significance['correlation_ci_high'].loc[window, lag])
+            + ', circular shift permutation p-value ' + '{:.4f}'.format(p_value) + ', '
+            + str(significance['resamples']) + ' resamples of ' + str(significance['block']) + '-month blocks). '
+            + ('It is statistically significant at the ' + level + ' level, so housing price changes are a '
+               'predictor of the unemployment rate with ' + str(lag) + ' month lags.' if p_value < alpha else
+               'It is not statistically significant at the ' + level + ' level, so this lead alone does not show '
+               'that housing price changes predict the unemployment rate.')
+            + ' ' + str(int((regression['P-Value'] < alpha).sum())) + ' of the ' + str(len(regression))
+            + ' lag regressions have an R2 significant at the same level:\n\n')
+    table = ('\\begin{table}[H]\n\\centering\n\\begin{tabular}{@{} l*{4}{>{}c<{}} @{}}\n\\toprule\n'
+             'Total Lag & R2 & CI Low & CI High & P-Value \\\\\n\\midrule\n'
+             + generate_dataframe_latex(regression, ['Total Lag', 'R2', 'CI Low', 'CI High', 'P-Value'])
+             + '\\bottomrule\n\\end{tabular}\n\\caption{' + level + ' Confidence Intervals and Permutation '
+             'P-Values of the Lag Regressions}\n\\end{table}\n')
+    return text + table
+
+# Function to find the pdflatex binary: the PDFLATEX environment variable, then PATH, then the MiKTeX default
+def find_tex_binary(tex=None):
+    candidates = [tex, os.environ.get('PDFLATEX'), shutil.which('pdflatex'), MIKTEX_PDFLATEX]
+    for candidate in candidates:
+        if candidate and (os.path.exists(candidate) or shutil.which(candidate)):
+            return candidate
+    raise FileNotFoundError('pdflatex not found, install a TeX distribution or set the PDFLATEX environment variable')
+
+# Function to hash a .tex file together with every figure it includes
+def latex_key(latex_file):
+    digest = hashlib.sha256()
+    with open(latex_file, 'rb') as file:
+        latex_code = file.read()
+    digest.update(latex_code)
+    for image in re.findall(rb'\\includegraphics(?:\[[^\]]*\])?\{([^}]+)\}', latex_code):
+        image_file = os.path.join(os.path.dirname(latex_file), image.decode())
+        if os.path.exists(image_file):
+            with open(image_file, 'rb') as file:
+                digest.update(file.read())
+    return digest.hexdigest()
 
 # Function to compile LaTeX document into PDF
-def compile_latex_to_pdf(latex_file,cwd):
-    subprocess.run([r"C:\Users\siaha\AppData\Local\Programs\MiKTeX\miktex\bin\x64\pdflatex",
-                        latex_file],
-                        check=True,
-                        cwd=cwd)
+# The compile runs in an isolated temp dir and reruns pdflatex while it asks for it (like latexmk).
+# It is skipped when the pdf exists and the .tex and its figures did not change since the last compile.
+@profiled('pdflatex')
+def compile_latex_to_pdf(latex_file,cwd, tex=None):
+    import subprocess
+    import tempfile
+    pdf_path = os.path.splitext(latex_file)[0] + '.pdf'
+    key_path = cwd + CACHE_DIR + LATEX_KEYS_DIR + os.path.basename(pdf_path) + '.sha256'
+    key = latex_key(latex_file)
+    if os.path.exists(pdf_path) and os.path.exists(key_path):
+        with open(key_path) as file:
+            if file.read() == key:
+                return pdf_path
+
+    binary = find_tex_binary(tex)
+    name = os.path.basename(latex_file)
+    with tempfile.TemporaryDirectory() as build_dir:
+        shutil.copyfile(latex_file, os.path.join(build_dir, name))
+        for run in range(LATEX_MAX_RUNS):
+            subprocess.run([binary, '-interaction=nonstopmode', '-halt-on-error', name],
+                           check=True,
+                           cwd=build_dir,
+                           stdout=subprocess.DEVNULL)
+            log_path = os.path.join(build_dir, os.path.splitext(name)[0] + '.log')
+            if not os.path.exists(log_path):
+                break
+            with open(log_path, errors='replace') as log:
+                if 'Rerun to get' not in log.read():
+                    break
+        shutil.copyfile(os.path.join(build_dir, os.path.splitext(name)[0] + '.pdf'), pdf_path)
+
+    # Written to a temp file first, the rename is atomic so a concurrent reader never sees half a key
+    os.makedirs(os.path.dirname(key_path), exist_ok=True)
+    temp_path = key_path + '.' + str(os.getpid()) + '.' + str(threading.get_ident())
+    with open(temp_path, 'w') as file:
+        file.write(key)
+    os.replace(temp_path, key_path)
+    return pdf_path
 
 #Report function to generate pdf report for this analysis
-def generate_pdf_report(date: str, dir: str):
+@profiled('report:pdf')
+def generate_pdf_report(date: str, dir: str, analysis=None, jobs=1):
+    if analysis is None:
+        analysis = run_analysis(dir, resamples=BOOTSTRAP_RESAMPLES, rolling=True)
     #Generate All Table and Images we need for exploratory Analysis
-    master = process_raw_data(dir)
-    stationary_result = stationary_test(master)
-    timeseries_recession_graph(master, dir + 'timeseries1.png')
-    first_corr = ['UNRATE', 'MSPNHSUS', 'house_diff', 'house_return']
-    first_matrix = ['UNRATE', 'house_diff', 'house_return']
-    correlation_plot(master, first_corr, dir + 'correlationplot1.png')
-    correlation_matrix(master, first_matrix, dir +'corrmatrix1.png')
-    #Generate Regression Result
-    regression_result = ols_regression_lag(master,24, 'house_diff')
-    regression_plot(regression_result, dir +'regression_result.png')
-    #Generate Result graphs
-    master['house_6MA'] = master['house_diff'].rolling(window=6).mean()
-    master['house_12MA'] = master['house_diff'].rolling(window=12).mean()
-    master['house_24MA'] = master['house_diff'].rolling(window=24).mean()
-    master['house_36MA'] = master['house_diff'].rolling(window=36).mean()
-    master['house_48MA'] = master['house_diff'].rolling(window=48).mean()
-    master['house_60MA'] = master['house_diff'].rolling(window=60).mean()
-    second_corr = ['UNRATE', 'house_diff','house_6MA','house_12MA','house_24MA','house_36MA','house_48MA']
-    second_matrix = ['UNRATE','house_diff','house_6MA','house_12MA','house_24MA','house_36MA','house_48MA']
-    correlation_plot(master, second_corr, dir + 'correlationplot2.png')
-    correlation_matrix(master, second_matrix, dir + 'corrmatrix2.png')
-    timeseries_recession_graph_after(master, dir + 'timeseries2.png')
+    stationary_result = analysis['stationary_result']
+    regression_result = analysis['regression_result']
+    render_figures(pdf_figure_jobs(analysis, dir), jobs, dir + CACHE_DIR + 'figures/')
 
     # Generate LaTeX report template
 
     report_path = dir + date.strftime("%Y%m%d") +"_unemployment_house_report.tex"
-    image_path= r'C:/Users/siaha/PycharmProjects/Unemployment_House/Analytics_Output/'
-    generate_latex_report(stationary_result, regression_result, image_path, report_path)
+    image_path = os.path.abspath(dir).replace('\\', '/') + '/'
+    report_date = date.strftime("%b ") + str(date.day) + date.strftime(", %Y")
+    generate_latex_report(stationary_result, regression_result, image_path, report_path, optimal_lag(analysis),
+                          report_date, conclusion=generate_conclusion_latex(analysis))
 
     # Compile LaTeX file to PDF
     compile_latex_to_pdf(report_path,dir)
 
     return 0
 
+# Function to read the assets inlined in offline html bundles, read once and shared by every report
+@lru_cache(maxsize=None)
+def offline_assets():
+    from plotly.offline import get_plotlyjs
+    return get_plotlyjs(), OFFLINE_CSS
+
+# Function to embed an image as a data uri, lossless webp is used when Pillow can write it and it is smaller
+def image_data_uri(path):
+    with open(path, 'rb') as file:
+        mime, data = 'image/png', file.read()
+    try:
+        from PIL import Image
+        buffer = io.BytesIO()
+        with Image.open(path) as image:
+            image.save(buffer, format='WEBP', lossless=True)
+        if len(buffer.getvalue()) < len(data):
+            mime, data = 'image/webp', buffer.getvalue()
+    except (ImportError, OSError, KeyError):
+        pass
+    return 'data:' + mime + ';base64,' + base64.b64encode(data).decode('ascii')
+
+# Function to write gzip (and brotli, when installed) copies of a page for static servers
+def write_compressed_copies(output_path, content):
+    with gzip.open(output_path + '.gz', 'wb', compresslevel=9) as file:
+        file.write(content)
+    try:
+        import brotli
+    except ImportError:
+        return 0
+    with open(output_path + '.br', 'wb') as file:
+        file.write(brotli.compress(content))
+    return 0
+
+# Function to write the html data payload: one shared date axis and one rounded array per column
+# The charts downsample the visible range in the page (see HTML_ZOOM_JS), so only the full series is embedded
+def html_series_payload(master, columns, decimals=HTML_DECIMALS):
+    dates = master.index.strftime('%Y-%m-%d').tolist()
+    series = {}
+    for col in columns:
+        values = np.round(master[col].to_numpy(dtype=float), decimals)
+        series[col] = [None if np.isnan(value) else value for value in values.tolist()]
+    return ('const dates = ' + json.dumps(dates, separators=(',', ':')) + ';\n        ' +
+            'const series = ' + json.dumps(series, separators=(',', ':')) + ';\n        ' +
+            'const downsamplePoints = ' + str(DOWNSAMPLE_POINTS) + ';')
+
+# Script of the html report that plots the visible range of each column, ranges longer than downsamplePoints
+# keep the minimum and maximum of each of downsamplePoints / 2 buckets (as minmax_indices), and the chart is
+# redrawn from the full series when it is zoomed (range slider, range buttons or drag)
+HTML_ZOOM_JS = '''
+        function lowerBound(values, target) {
+            let lo = 0, hi = values.length;
+            while (lo < hi) {
+                const mid = (lo + hi) >> 1;
+                if (values[mid] < target) lo = mid + 1; else hi = mid;
+            }
+            return lo;
+        }
+        function viewSeries(col, range) {
+            const values = series[col];
+            const a = range ? Math.max(lowerBound(dates, range[0]) - 1, 0) : 0;
+            const b = range ? Math.min(lowerBound(dates, range[1]) + 1, dates.length) : dates.length;
+            if (b - a <= downsamplePoints) return {x: dates.slice(a, b), y: values.slice(a, b)};
+            const buckets = downsamplePoints >> 1, idx = [];
+            for (let k = 0; k < buckets; k++) {
+                const end = a + Math.floor((b - a) * (k + 1) / buckets);
+                let low = -1, high = -1;
+                for (let i = a + Math.floor((b - a) * k / buckets); i < end; i++) {
+                    if (values[i] === null) continue;
+                    if (low < 0 || values[i] < values[low]) low = i;
+                    if (high < 0 || values[i] > values[high]) high = i;
+                }
+                if (low >= 0) idx.push(...(low === high ? [low] : [Math.min(low, high), Math.max(low, high)]));
+            }
+            return {x: idx.map(i => dates[i]), y: idx.map(i => values[i])};
+        }
+        function followZoom(graphId, columns) {
+            const graph = document.getElementById(graphId);
+            graph.on('plotly_relayout', function(event) {
+                if (dates.length <= downsamplePoints) return;
+                let range = null;
+                if (event['xaxis.range[0]'] !== undefined) range = [event['xaxis.range[0]'], event['xaxis.range[1]']];
+                else if (event['xaxis.range']) range = event['xaxis.range'];
+                else if (!event['xaxis.autorange']) return;
+                const views = columns().map(col => viewSeries(col, range));
+                Plotly.restyle(graphId, {x: views.map(view => view.x), y: views.map(view => view.y)});
+            });
+        }
+'''
+
 #Report function to generate html report for this analysis
-def generate_html_report(date: str, dir: str):
-    master = process_raw_data(dir)
-    stationary_result = stationary_test(master)
+# bundle=True writes a self-contained page (inlined Plotly, css and images) plus a pre-compressed copy
+@profiled('report:html')
+def generate_html_report(date: str, dir: str, analysis=None, jobs=1, bundle=False):
+    import plotly.graph_objs as go
+    from plotly.offline import get_plotlyjs_version
+    from plotly.subplots import make_subplots
+    if analysis is None:
+        analysis = run_analysis(dir)
+    stationary_result = analysis['stationary_result']
     #Generate Result graphs
-    master['house_6MA'] = master['house_diff'].rolling(window=6).mean()
-    master['house_12MA'] = master['house_diff'].rolling(window=12).mean()
-    master['house_24MA'] = master['house_diff'].rolling(window=24).mean()
-    master['house_36MA'] = master['house_diff'].rolling(window=36).mean()
-    master['house_48MA'] = master['house_diff'].rolling(window=48).mean()
-    master['house_60MA'] = master['house_diff'].rolling(window=60).mean()
-    second_corr = ['UNRATE', 'house_diff','house_6MA','house_12MA','house_24MA','house_36MA','house_48MA']
-    second_matrix = ['UNRATE','house_diff','house_6MA','house_12MA','house_24MA','house_36MA','house_48MA']
-    correlation_plot(master, second_corr, dir + 'correlationplot2.png')
-    correlation_matrix(master, second_matrix, dir + 'corrmatrix2.png')
-
-    # Create a figure with secondary y-axis
+    master = analysis['ma_master']
+    render_figures(html_figure_jobs(analysis, dir), jobs, dir + CACHE_DIR + 'figures/')
+
+    # Create a figure with secondary y-axis, its traces are filled in the page from the shared data payload
     fig = make_subplots(specs=[[{"secondary_y": True}]])
-    fig.add_trace(go.Scatter(x=master.index, y=master['UNRATE'], mode='lines', name='Unemployment Rate'),
+    fig.add_trace(go.Scatter(x=[], y=[], mode='lines', name='Unemployment Rate'),
                   secondary_y=False)
     # Add the second trace (new line)
-    fig.add_trace(go.Scatter(x=master.index, y=master['MSPNHSUS'], mode='lines', name='Median House Price',
+    fig.add_trace(go.Scatter(x=[], y=[], mode='lines', name='Median House Price',
                              line=dict(dash='dash')), secondary_y=True)
 
     # Update layout to include slider
@@ -492,16 +1576,37 @@ def generate_html_report(date: str, dir: str):
                 activecolor='rgba(80, 80, 80, 1)',  # Darker shade for active button
                 bordercolor='rgba(200, 200, 200, 0.6)'  # Subtle border color for contrast
             ),
-            rangeslider=dict(visible=True),  # Add the range slider
+            # Add the range slider, kept on the full date range as the traces only hold the visible part
+            rangeslider=dict(visible=True, range=[master.index[0].strftime('%Y-%m-%d'),
+                                                  master.index[-1].strftime('%Y-%m-%d')]),
             type="date"
         ),
         yaxis=dict(title='Unemployment Rate', side='left'),  # Primary y-axis on the left
         yaxis2=dict(title='Median House Price', side='right'),  # Secondary y-axis on the right
+        shapes=plotly_event_shapes(recession_events(), master.index, kinds=('recession',)),
         template='plotly_dark'
     )
 
     # Save the interactive graph to HTML
-    graph_html = plot(fig, output_type='div', include_plotlyjs='cdn')
+    graph_html = f"""<div id="main-graph"></div>
+    <script>
+        const mainFigure = {fig.to_json()};
+        const mainColumns = () => ['UNRATE', 'MSPNHSUS'];
+        mainColumns().forEach((col, k) => Object.assign(mainFigure.data[k], viewSeries(col, null)));
+        Plotly.newPlot('main-graph', mainFigure.data, mainFigure.layout);
+        followZoom('main-graph', mainColumns);
+    </script>"""
+    if bundle:
+        plotly_js, offline_css = offline_assets()
+        head_assets = f"""<style>{offline_css}</style>
+        <script>{plotly_js}</script>"""
+        image_src = {name: image_data_uri(dir + name) for name in ['correlationplot2.png', 'corrmatrix2.png']}
+    else:
+        plotly_js_url = 'https://cdn.plot.ly/plotly-' + get_plotlyjs_version() + '.min.js'
+        head_assets = f"""<link href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css" rel="stylesheet">
+        <script src="{plotly_js_url}"></script>"""
+        # The images are written next to the report, so relative paths keep working when the folder moves
+        image_src = {name: name for name in ['correlationplot2.png', 'corrmatrix2.png']}
 
     # Create an HTML table from the DataFrame
     table_html = stationary_result[['Description', 'P-Value', 'Result']].to_html(
@@ -512,13 +1617,18 @@ def generate_html_report(date: str, dir: str):
         table_id = 'data-table'
     )
 
+    # Options of the moving average selector and the data shared by every chart of the page
+    ma_options_html = '\n            '.join(f'<option value="{ma_column(window)}">{window}-Month Moving Average</option>'
+                                          for window in HTML_MA_WINDOWS)
+    data_js = html_series_payload(master, ['UNRATE', 'MSPNHSUS'] + [ma_column(window) for window in HTML_MA_WINDOWS])
+
     # Create an HTML template with custom filtering functionality
     html_template = f"""
     <!DOCTYPE html>
     <html>
     <head>
         <title>US Unemployment Rate Vs. Median House Sale Price in the US</title>
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css" rel="stylesheet">
+        {head_assets}
         <style>
             body {{
                 background-color: #2c2c2c;
@@ -605,6 +1715,10 @@ def generate_html_report(date: str, dir: str):
     <h1>US Unemployment Rate Vs. Median House Sale Price in the US</h1>
     <p>Unemployment is an important indicators used to explain US economy performance, and it is proved to be highly correlated to recession. On the other hand, Housing market is always involved either directly or indirectly in US recession, especially in 2008. </p>
     <p>This analysis wants to explore whether housing price can be used as a predictor to US recession (using umeployment rate to represent the recession cycle). They are very likely to have a negative correlation as housing market usually goes down when unemployment goes up. It's also very likely there would be lagging effects between the two, as housing market usually starts to go down before umemployment starts to go up. If there are measurable lags, how many months would that be?</p>
+    <script>
+        {data_js}
+        {HTML_ZOOM_JS}
+    </script>
     {graph_html}
     <!-- Dropdown filter for Result column -->
     <div class="filter-container">
@@ -622,44 +1736,31 @@ def generate_html_report(date: str, dir: str):
     </div>
     <div class="image-container">
         <h2>Correlation Plots with Different Moving Average Periods</h2>
-        <img src="{dir}correlationplot2.png" alt="Correlation Plot">
+        <img src="{image_src['correlationplot2.png']}" alt="Correlation Plot">
         <h2>Correlation Matrix with Different Moving Average Periods</h2>
-        <img src="{dir}corrmatrix2.png" alt="Correlation Matrix">
+        <img src="{image_src['corrmatrix2.png']}" alt="Correlation Matrix">
     </div>
     <div id="time-series-filter-container" style="text-align: center; margin: 20px;">
         <label for="time-series-filter" style="color: white;">Select Moving Average Column:</label>
         <select id="time-series-filter" class="form-select" onchange="updateTimeSeriesPlot()">            
-            <option value="house_12MA">12-Month Moving Average</option>
-            <option value="house_24MA">24-Month Moving Average</option>
-            <option value="house_36MA">36-Month Moving Average</option>
-            <option value="house_48MA">48-Month Moving Average</option>
+            {ma_options_html}
         </select>
     </div>
     <div id="time-series-plot-container" style="width: 90%; margin: auto;">
         <div id="time-series-plot"></div>
     </div>
     <script>
-        const data = {{
-            house_12MA: {{x: {json.dumps([ts.isoformat() for ts in master.index.tolist()])}, y: {json.dumps(master['house_12MA'].tolist())}}},
-            house_24MA: {{x: {json.dumps([ts.isoformat() for ts in master.index.tolist()])}, y: {json.dumps(master['house_24MA'].tolist())}}},
-            house_36MA: {{x: {json.dumps([ts.isoformat() for ts in master.index.tolist()])}, y: {json.dumps(master['house_36MA'].tolist())}}},
-            house_48MA: {{x: {json.dumps([ts.isoformat() for ts in master.index.tolist()])}, y: {json.dumps(master['house_48MA'].tolist())}}},
-            UNRATE: {{x: {json.dumps([ts.isoformat() for ts in master.index.tolist()])}, y: {json.dumps(master['UNRATE'].tolist())}}}
-        }}
-    
         function updateTimeSeriesPlot() {{
             const selectedColumn = document.getElementById('time-series-filter').value;
             const plotData = [
             {{
-                x: data[selectedColumn].x,
-                y: data[selectedColumn].y,
+                ...viewSeries(selectedColumn, null),
                 mode: 'Housing Price Moving Average',
                 name: selectedColumn,
                 line: {{color: '#1f77b4',dash: 'dash'}}
             }},
             {{
-                x: data.UNRATE.x,
-                y: data.UNRATE.y,
+                ...viewSeries('UNRATE', null),
                 mode: 'lines',
                 name: 'Unemployment Rate (UNRATE)',
                 line: {{color: '#ff7f0e'}},
@@ -676,8 +1777,10 @@ def generate_html_report(date: str, dir: str):
                 side: 'right',
                 overlaying: 'y'
             }},
+            shapes: mainFigure.layout.shapes,
             template: 'plotly_dark'
         }})
+        followZoom('time-series-plot', () => [document.getElementById('time-series-filter').value, 'UNRATE']);
         }}
         updateTimeSeriesPlot();
     </script>
@@ -686,25 +1789,127 @@ def generate_html_report(date: str, dir: str):
     """
 
     # Save the HTML report
-    output_path = dir + date.strftime("%Y%m%d") +"_unemployment_house_report.html"
+    if bundle:
+        output_path = dir + date.strftime("%Y%m%d") +"_unemployment_house_report_bundle.html"
+    else:
+        output_path = dir + date.strftime("%Y%m%d") +"_unemployment_house_report.html"
     with open(output_path, "w") as f:
         f.write(html_template)
+    if bundle:
+        write_compressed_copies(output_path, html_template.encode('utf-8'))
 
     print(f"Report saved to {output_path}")
 
     return 0
 
+# Function to list the sheets of the excel report, features=True adds the MA/lag features and grid search tables
+def excel_sheets(analysis, features=False, nlag=24, col='house_diff'):
+    sheets = [
+        ('Stationary_Analytics', analysis['stationary_result'][['Description','P-Value', 'Result']], False),
+        ('Regression_Result', analysis['regression_result'], False),
+        ('Raw', analysis['master'], True),
+    ]
+    significance = analysis.get('significance')
+    if significance is not None:
+        sheets.insert(2, ('Regression_Significance', significance['regression'], False))
+    if features:
+        master = analysis['master']
+        lag_columns = [col] + ['lag_' + str(i) for i in range(1, nlag + 1)]
+        lag_features = pd.DataFrame(lag_matrix(master, nlag, col), index=master.index, columns=lag_columns)
+        grid = analysis['correlation_grid']
+        sheets += [
+            ('MA_Features', analysis['ma_master'], True),
+            ('Lag_Features', lag_features, True),
+            ('Correlation_Grid', grid['grid'].rename(columns=lambda lag: 'Lag ' + str(lag)), True),
+            ('Rolling_R2', analysis['rolling_regression']['R2'].rename(columns=lambda lag: 'Lag ' + str(lag)), True),
+            ('Rolling_Coefficients', analysis['rolling_regression']['coefficients'], True),
+            ('Best_Lag_By_MA', grid['best_lag_by_window'].to_frame(), True),
+        ]
+        if significance is not None:
+            sheets += [(sheet_name, significance[key].rename(columns=lambda lag: 'Lag ' + str(lag)), True)
+                       for sheet_name, key in [('Correlation_CI_Low', 'correlation_ci_low'),
+                                               ('Correlation_CI_High', 'correlation_ci_high'),
+                                               ('Correlation_P_Value', 'correlation_p_value')]]
+    return sheets
+
+# Function to write one sheet row by row, so the workbook can be written in constant memory mode
+# Consecutive columns of the same type share one write_row call with the typed format of that column type
+def write_excel_sheet(workbook, sheet_name, df, index, formats, chunksize=10000):
+    worksheet = workbook.add_worksheet(sheet_name)
+    if index:
+        df = df.reset_index()
+    kinds = []
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            kinds.append('date')
+        elif pd.api.types.is_integer_dtype(df[column]):
+            kinds.append('int')
+        elif pd.api.types.is_float_dtype(df[column]):
+            kinds.append('float')
+        else:
+            kinds.append('text')
+    groups = []
+    for position, kind in enumerate(kinds):
+        if groups and groups[-1][2] == kind:
+            groups[-1][1] = position + 1
+        else:
+            groups.append([position, position + 1, kind])
+
+    worksheet.write_row(0, 0, [str(column) for column in df.columns], formats['header'])
+    for start, end, kind in groups:
+        worksheet.set_column(start, end - 1, 22 if kind == 'text' else 12, formats[kind])
+    for chunk_start in range(0, len(df), chunksize):
+        block = df.iloc[chunk_start:chunk_start + chunksize]
+        rows = block.astype(object).where(block.notna(), None).to_numpy().tolist()
+        for offset, row in enumerate(rows):
+            for start, end, kind in groups:
+                worksheet.write_row(chunk_start + offset + 1, start, row[start:end], formats[kind])
+    return worksheet
+
 #Report function to generate excel report for this analysis
-def generate_excel_report(date: str, dir: str):
-    master = process_raw_data(dir)
-    stationary_result = stationary_test(master)
-    regression_result = ols_regression_lag(master, 24, 'house_diff')
+# The workbook is streamed with xlsxwriter in constant memory mode, the pandas ExcelWriter is the fallback
+@profiled('report:excel')
+def generate_excel_report(date: str, dir: str, analysis=None, features=False):
+    if analysis is None:
+        analysis = run_analysis(dir, rolling=features)
+    sheets = excel_sheets(analysis, features)
     # Write the DataFrames to an Excel file
-    report_path = dir + date.strftime("%Y%m%d") + "_unemployment_house_report.xlsx"
-    with pd.ExcelWriter(report_path) as writer:
-        stationary_result[['Description','P-Value', 'Result']].to_excel(writer, sheet_name='Stationary_Analytics', index=False)
-        regression_result.to_excel(writer, sheet_name='Regression_Result', index=False,header=True)
-        master.to_excel(writer, sheet_name='Raw', index=True)
+    report_path = dir + date.strftime("%Y%m%d") + ("_unemployment_house_features.xlsx" if features
+                                                   else "_unemployment_house_report.xlsx")
+    try:
+        import xlsxwriter
+    except ImportError:
+        with pd.ExcelWriter(report_path) as writer:
+            for sheet_name, df, index in sheets:
+                df.to_excel(writer, sheet_name=sheet_name, index=index)
+        return
+
+    workbook = xlsxwriter.Workbook(report_path, {'constant_memory': True, 'strings_to_numbers': False})
+    formats = {
+        'header': workbook.add_format({'bold': True, 'border': 1, 'align': 'center'}),
+        'date': workbook.add_format({'num_format': 'yyyy-mm-dd'}),
+        'int': workbook.add_format({'num_format': '0'}),
+        'float': workbook.add_format({'num_format': 'General'}),
+        'text': None,
+    }
+    for sheet_name, df, index in sheets:
+        write_excel_sheet(workbook, sheet_name, df, index, formats)
+    workbook.close()
 
     return
 
+# Function to write the raw data and features as parquet (when pyarrow is installed) or csv, for consumers
+# that do not need excel
+@profiled('report:data')
+def generate_data_sidecar(date: str, dir: str, analysis=None):
+    if analysis is None:
+        analysis = run_analysis(dir)
+    data = analysis['ma_master']
+    report_path = dir + date.strftime("%Y%m%d") + "_unemployment_house_data"
+    try:
+        import pyarrow
+    except ImportError:
+        data.to_csv(report_path + '.csv', index=True, date_format='%Y-%m-%d')
+        return report_path + '.csv'
+    data.to_parquet(report_path + '.parquet', index=True)
+    return report_path + '.parquet'
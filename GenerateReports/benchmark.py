@@ -0,0 +1,241 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from Reporting import UnrateHouse
+
+# python GenerateReports/benchmark.py run --rows 1000,10000 -o bench.json
+# python GenerateReports/benchmark.py compare baseline.json bench.json --threshold 0.2
+# The benchmarks run on synthetic FRED-like csv files, so no network or real data is needed
+
+# Benchmark groups, --only runs a subset (e.g. --only analysis,plots)
+GROUPS = ['imports', 'analysis', 'plots', 'reports']
+# Lag counts of the ols_regression_lag benchmarks
+NLAGS = [6, 12, 24, 48]
+# Frequencies tried for the synthetic dates, the first one whose dates fit before pandas' last timestamp is used
+# (monthly like FRED for small inputs, then daily and hourly so 1M rows still have valid dates)
+DATE_FREQUENCIES = ['MS', 'D', 'h', 'min']
+START_DATE = '1948-01-01'
+# Resamples of the significance test benchmark, the timing grows linearly with them
+SIGNIFICANCE_RESAMPLES = 200
+
+
+# Function to write synthetic UNRATE.csv and MSPNHSUS.csv with rows observations into dir
+# UNRATE is a mean reverting AR(1) around 5.5%, MSPNHSUS a log random walk with drift starting at 18000
+def write_synthetic_data(dir, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    for freq in DATE_FREQUENCIES:
+        try:
+            dates = pd.date_range(START_DATE, periods=rows, freq=freq, unit='ns')
+            break
+        except pd.errors.OutOfBoundsDatetime:
+            continue
+    shocks = rng.normal(0, 0.2, rows)
+    unrate = np.empty(rows)
+    unrate[0] = 5.5
+    for k in range(1, rows):
+        unrate[k] = 5.5 + 0.97 * (unrate[k - 1] - 5.5) + shocks[k]
+    # Drift and volatility shrink with rows so the price ends near today's level whatever the length
+    house = 18000 * np.exp(np.cumsum(rng.normal(3 / rows, min(0.02, 1 / np.sqrt(rows)), rows)))
+
+    date_strings = dates.strftime('%Y-%m-%d' if freq in ('MS', 'D') else '%Y-%m-%d %H:%M:%S')
+    pd.DataFrame({'DATE': date_strings, 'UNRATE': np.round(np.clip(unrate, 0.5, None), 1)}).to_csv(
+        dir + 'UNRATE.csv', index=False)
+    pd.DataFrame({'DATE': date_strings, 'MSPNHSUS': np.round(house, -2)}).to_csv(dir + 'MSPNHSUS.csv', index=False)
+
+# Function to time fn over repeat runs, then run it once more under tracemalloc for the peak memory
+# setup runs before every call and is not timed
+def measure(fn, repeat=3, setup=None):
+    times = []
+    for k in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'wall_min': min(times), 'wall_median': statistics.median(times), 'peak_mb': peak / 2 ** 20}
+
+# Function to time the import of the reporting module in a fresh interpreter
+def import_time():
+    code = ('import time; start = time.perf_counter(); from Reporting import UnrateHouse; '
+            'print(time.perf_counter() - start)')
+    output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+# Function to list the benchmarks of one input size as (group, name, function, setup)
+def benchmark_cases(dir, analysis, nlags=NLAGS):
+    master = analysis['master']
+    date = datetime.datetime(2024, 12, 1)
+
+    def clear_caches():
+        shutil.rmtree(dir + UnrateHouse.CACHE_DIR, ignore_errors=True)
+        UnrateHouse.ADF_RESULTS.clear()
+
+    cases = [
+        ('analysis', 'process_raw_data', lambda: UnrateHouse.process_raw_data(dir, use_cache=False), None),
+        ('analysis', 'process_raw_data_cached', lambda: UnrateHouse.process_raw_data(dir),
+         lambda: UnrateHouse.process_raw_data(dir)),
+        ('analysis', 'stationary_test', lambda: UnrateHouse.stationary_test(master), clear_caches),
+        ('analysis', 'add_moving_averages', lambda: UnrateHouse.add_moving_averages(master), None),
+        ('analysis', 'correlation_grid', lambda: UnrateHouse.correlation_grid(master), None),
+    ]
+    if len(master) <= UnrateHouse.SIGNIFICANCE_MAX_ROWS:
+        cases.append(('analysis', 'significance_tests_' + str(SIGNIFICANCE_RESAMPLES),
+                      lambda: UnrateHouse.significance_tests(master, resamples=SIGNIFICANCE_RESAMPLES), None))
+    for nlag in nlags:
+        cases.append(('analysis', 'ols_regression_lag_' + str(nlag),
+                      lambda nlag=nlag: UnrateHouse.ols_regression_lag(master, nlag, 'house_diff'), None))
+        cases.append(('analysis', 'rolling_ols_regression_lag_' + str(nlag),
+                      lambda nlag=nlag: UnrateHouse.rolling_ols_regression_lag(master, nlag, 'house_diff'), None))
+
+    figure_jobs = {os.path.basename(output_path): (plot_function, inputs, output_path)
+                   for plot_function, inputs, output_path in
+                   UnrateHouse.pdf_figure_jobs(analysis, dir) + UnrateHouse.html_figure_jobs(analysis, dir)}
+    for file_name, (plot_function, inputs, output_path) in figure_jobs.items():
+        cases.append(('plots', plot_function.__name__ + ':' + file_name,
+                      lambda plot_function=plot_function, inputs=inputs, output_path=output_path:
+                      plot_function(*inputs, output_path), None))
+
+    generators = [
+        ('generate_html_report', lambda: UnrateHouse.generate_html_report(date, dir, analysis)),
+        ('generate_html_bundle', lambda: UnrateHouse.generate_html_report(date, dir, analysis, bundle=True)),
+        ('generate_excel_report', lambda: UnrateHouse.generate_excel_report(date, dir, analysis)),
+        ('generate_data_sidecar', lambda: UnrateHouse.generate_data_sidecar(date, dir, analysis)),
+    ]
+    try:
+        UnrateHouse.find_tex_binary()
+        generators.append(('generate_pdf_report', lambda: UnrateHouse.generate_pdf_report(date, dir, analysis)))
+    except FileNotFoundError:
+        pass
+    for name, fn in generators:
+        cases.append(('reports', name, fn, clear_caches))
+    return cases
+
+# Function to run every benchmark for every input size, returns the JSON-ready result
+def run_benchmarks(rows_list, repeat=3, groups=GROUPS, nlags=NLAGS, seed=0):
+    results = []
+    if 'imports' in groups:
+        times = [import_time() for k in range(repeat)]
+        results.append({'group': 'imports', 'name': 'import UnrateHouse', 'rows': 0, 'repeat': repeat,
+                        'wall_min': min(times), 'wall_median': statistics.median(times), 'peak_mb': None})
+
+    for rows in rows_list:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dir = temp_dir + '/'
+            write_synthetic_data(dir, rows, seed)
+            master = UnrateHouse.process_raw_data(dir, use_cache=False)
+            # The significance tests are slow on long inputs, they only run when benchmarked themselves
+            analysis = UnrateHouse.build_analysis(master, rolling=True, resamples=(SIGNIFICANCE_RESAMPLES
+                                                                                   if 'analysis' in groups else 0))
+            for group, name, fn, setup in benchmark_cases(dir, analysis, nlags):
+                if group not in groups:
+                    continue
+                result = measure(fn, repeat, setup)
+                results.append({'group': group, 'name': name, 'rows': rows, 'repeat': repeat, **result})
+                print('{:>9} {:<45} {:9.4f}s {:9.1f}MB'.format(rows, name, result['wall_median'], result['peak_mb']))
+
+    return {
+        'meta': {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'rows': list(rows_list),
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+# Function to compare a benchmark result with a baseline, a benchmark regresses when its median wall time
+# (or peak memory) grew by more than threshold, e.g. 0.2 = 20%
+def compare_benchmarks(baseline, current, threshold=0.2):
+    base = {(entry['name'], entry['rows']): entry for entry in baseline['results']}
+    rows = []
+    for entry in current['results']:
+        old = base.get((entry['name'], entry['rows']))
+        if old is None:
+            continue
+        time_ratio = entry['wall_median'] / old['wall_median'] if old['wall_median'] else np.nan
+        memory_ratio = (entry['peak_mb'] / old['peak_mb']
+                        if entry['peak_mb'] is not None and old['peak_mb'] else np.nan)
+        rows.append({
+            'name': entry['name'],
+            'rows': entry['rows'],
+            'baseline_s': old['wall_median'],
+            'current_s': entry['wall_median'],
+            'time_ratio': time_ratio,
+            'memory_ratio': memory_ratio,
+            'regression': bool(time_ratio > 1 + threshold or memory_ratio > 1 + threshold),
+        })
+    return pd.DataFrame(rows, columns=['name', 'rows', 'baseline_s', 'current_s', 'time_ratio', 'memory_ratio',
+                                       'regression'])
+
+#function for arguments definition
+def benchmark_arg():
+    parser = argparse.ArgumentParser(description="Benchmark the analysis and report generation")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="run the benchmarks on synthetic data")
+    run.add_argument('--rows', type=str, default='1000,10000',
+                     help="comma separated input sizes: default 1000,10000 (100000 is the largest tested, it "
+                          "needs about 3 GB for the ADF tests)")
+    run.add_argument('--repeat', type=int, default=3, help="timed runs per benchmark: default 3")
+    run.add_argument('--only', type=str, default=','.join(GROUPS),
+                     help="comma separated groups to run: " + ','.join(GROUPS))
+    run.add_argument('--nlags', type=str, default=','.join(str(nlag) for nlag in NLAGS),
+                     help="lag counts of the regression benchmarks")
+    run.add_argument('--seed', type=int, default=0, help="seed of the synthetic data")
+    run.add_argument('-o', '--output', type=str, default='benchmark.json', help="JSON result file")
+    compare = commands.add_parser('compare', help="flag regressions against a stored baseline")
+    compare.add_argument('baseline', type=str, help="baseline JSON result file")
+    compare.add_argument('current', type=str, help="current JSON result file")
+    compare.add_argument('--threshold', type=float, default=0.2,
+                         help="allowed slow down (and memory growth) before flagging: default 0.2 = 20%%")
+    return parser.parse_args()
+
+def main(args):
+    if args.command == 'run':
+        result = run_benchmarks([int(rows) for rows in args.rows.split(',')], args.repeat,
+                                [group.strip() for group in args.only.split(',')],
+                                [int(nlag) for nlag in args.nlags.split(',')], args.seed)
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=2)
+        print('Benchmark saved to ' + args.output)
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+    comparison = compare_benchmarks(baseline, current, args.threshold)
+    print(comparison.to_string(index=False))
+    regressions = comparison[comparison['regression']]
+    if len(regressions):
+        print(str(len(regressions)) + ' benchmark(s) regressed by more than ' + str(int(args.threshold * 100)) + '%')
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    args = benchmark_arg()
+    sys.exit(main(args))
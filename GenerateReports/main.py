@@ -3,7 +3,8 @@ import datetime
 import logging
 import sys
 import tempfile
-from reports import report_runner
+from reports import report_runner, backfill_runner
+from Reporting import Profiler
 
 # python GenerateReports/main.py -r unratehouse_html -d 2024/12/01 -o C:\Users\siaha\PycharmProjects\Unemployment_House\Analytics_Output\\
 # I used this directory: r"C:\Users\siaha\PycharmProjects\Unemployment_House\Analytics_Output\\"
@@ -12,9 +13,29 @@ from reports import report_runner
 def report_arg():
     parser = argparse.ArgumentParser(description="Run Reports!")
     parser.add_argument( '-o', "--output",type=str,required=False, help="output directory")
-    parser.add_argument('-r', "--report",type=str,required=True,help="which report to run?")
+    parser.add_argument('-r', "--report",type=str,required=True,help="which report to run? separate several reports by comma")
     parser.add_argument('-d', '--date', type=str, required=False, dest='date',
                         help= "date string: default current day's date as 2019/12 /31")
+    parser.add_argument('-j', '--jobs', type=int, required=False, default=1,
+                        help="number of processes used to render figures: default 1")
+    parser.add_argument("--chunksize", type=int, required=False,
+                        help="read the csv files in chunks of this many rows (streaming mode for large inputs)")
+    parser.add_argument("--float32", action='store_true',
+                        help="store the series as float32 to reduce memory")
+    parser.add_argument("--incremental", action='store_true',
+                        help="update the saved state of the previous run with the new rows instead of recomputing "
+                             "(without the significance tests)")
+    parser.add_argument("--resamples", type=int, required=False, default=1000,
+                        help="block bootstrap resamples of the significance tests of the pdf report, 0 skips them: "
+                             "default 1000")
+    parser.add_argument("--profile", type=str, nargs='?', const='profile_trace.json', metavar='TRACE_FILE',
+                        help="time every stage, print a summary and write a Chrome trace (default profile_trace.json)")
+    parser.add_argument("--start", type=str, required=False,
+                        help="backfill: rerun the reports as of every date from this date (as 2019/12/31) to --end")
+    parser.add_argument("--end", type=str, required=False,
+                        help="backfill: last as of date (as 2019/12/31): default --date")
+    parser.add_argument("--freq", type=str, required=False, default='ME',
+                        help="backfill date frequency: default ME (month end)")
     args = parser.parse_args()
     return args
 
@@ -28,9 +49,28 @@ def main(args):
         logging.info("Please check your input args, must choose which report to run")
         sys.exit(10)
 
+    if args.profile:
+        Profiler.enable()
+    try:
+        run_reports(args, date, report_config)
+    finally:
+        if args.profile:
+            profile = Profiler.disable()
+            print(profile.summary().to_string(float_format='{:.3f}'.format))
+            print('Trace saved to ' + profile.write_trace(args.profile))
+
+# Function to run the reports, or the backfill when a start date is given
+def run_reports(args, date, report_config):
     # If no directory will just use temporary dir
     with tempfile.TemporaryDirectory() as temp_dir:
-        report_runner(date, report_config, args.output if args.output else temp_dir)
+        if args.start:
+            start = datetime.datetime.strptime(args.start, "%Y/%m/%d")
+            end = datetime.datetime.strptime(args.end, "%Y/%m/%d") if args.end else date
+            backfill_runner(start, end, args.freq, report_config, args.output if args.output else temp_dir,
+                            args.jobs)
+            return
+        report_runner(date, report_config, args.output if args.output else temp_dir, args.jobs,
+                      args.chunksize, 'float32' if args.float32 else 'float64', args.incremental, args.resamples)
 
 
 if __name__ == "__main__":
@@ -1,17 +1,106 @@
+import os
 import sys
-from Reporting import UnrateHouse
+from Reporting import Profiler, UnrateHouse
 
 #To call all the reports exist within this project
 
-def unratehouse_pdf(date :str, dir: str):
-    return UnrateHouse.generate_pdf_report(date, dir)
+def unratehouse_pdf(date :str, dir: str, analysis=None, jobs=1):
+    return UnrateHouse.generate_pdf_report(date, dir, analysis, jobs)
 
-def unratehouse_excel(date :str, dir: str):
-    return UnrateHouse.generate_excel_report(date, dir)
+def unratehouse_excel(date :str, dir: str, analysis=None, jobs=1):
+    return UnrateHouse.generate_excel_report(date, dir, analysis)
 
-def unratehouse_html(date :str, dir: str):
-    return UnrateHouse.generate_html_report(date, dir)
+# Excel report with the MA/lag feature matrix and correlation grid search as extra sheets
+def unratehouse_excel_features(date :str, dir: str, analysis=None, jobs=1):
+    return UnrateHouse.generate_excel_report(date, dir, analysis, features=True)
 
+# Raw data and MA features as parquet (or csv without pyarrow)
+def unratehouse_data(date :str, dir: str, analysis=None, jobs=1):
+    return UnrateHouse.generate_data_sidecar(date, dir, analysis)
 
-def report_runner(date :str, report_config: str, dir: str):
-    return getattr(sys.modules[__name__], report_config)(date, dir)
\ No newline at end of file
+def unratehouse_html(date :str, dir: str, analysis=None, jobs=1):
+    return UnrateHouse.generate_html_report(date, dir, analysis, jobs)
+
+# Self-contained html report for offline use, written with a pre-compressed .html.gz copy
+def unratehouse_html_bundle(date :str, dir: str, analysis=None, jobs=1):
+    return UnrateHouse.generate_html_report(date, dir, analysis, jobs, bundle=True)
+
+# Batch of many (unemployment, house price) pairs, from dir/batch_manifest.csv or the sub folders of dir
+def unratehouse_batch(date :str, dir: str, analysis=None, jobs=1):
+    from Reporting import BatchUnrateHouse
+    manifest = dir + BatchUnrateHouse.MANIFEST_FILE
+    source = manifest if os.path.exists(manifest) else dir
+    return BatchUnrateHouse.run_batch(source, dir, jobs,
+                                      report_name=date.strftime("%Y%m%d") + "_unemployment_house_batch_summary.csv")
+
+# Reports that do not use the single UNRATE/MSPNHSUS analysis
+BATCH_REPORTS = ['unratehouse_batch']
+# Report whose conclusion needs the significance tests, other reports only show them when run together with it
+SIGNIFICANCE_REPORT = 'unratehouse_pdf'
+# Reports that show the rolling regression, it is only computed when one of them is requested
+ROLLING_REPORTS = ['unratehouse_pdf', 'unratehouse_excel_features']
+
+
+# report_config can hold several reports separated by comma, e.g. unratehouse_pdf,unratehouse_html
+# all of them are rendered from one shared analysis result, jobs is the number of processes used for figures
+# chunksize reads the csv files in streaming mode, dtype can be float32 for large inputs
+# incremental updates the state of the previous run with the rows appended since then, it skips the significance
+# tests as they resample the whole history
+# resamples is the number of block bootstrap resamples of the significance tests shown in the pdf report,
+# they only run when the pdf report is requested (and the input is short enough), 0 skips them
+def report_runner(date :str, report_config: str, dir: str, jobs=1, chunksize=None, dtype='float64',
+                  incremental=False, resamples=UnrateHouse.BOOTSTRAP_RESAMPLES):
+    report_list = [report.strip() for report in report_config.split(',') if report.strip()]
+    if SIGNIFICANCE_REPORT not in report_list:
+        resamples = 0
+    rolling = any(report in ROLLING_REPORTS for report in report_list)
+    analysis = None
+    if any(report not in BATCH_REPORTS for report in report_list):
+        if incremental:
+            from Reporting import IncrementalUnrateHouse
+            analysis = IncrementalUnrateHouse.run_incremental_analysis(dir, chunksize=chunksize, dtype=dtype,
+                                                                       jobs=jobs, rolling=rolling)
+        else:
+            analysis = UnrateHouse.run_analysis(dir, chunksize=chunksize, dtype=dtype, jobs=jobs,
+                                                resamples=resamples, rolling=rolling)
+    results = []
+    for report in report_list:
+        with Profiler.stage('report_runner:' + report):
+            results.append(getattr(sys.modules[__name__], report)(date, dir, analysis, jobs))
+    return results[0] if len(results) == 1 else results
+
+
+# Function to render the reports of one backfill date, module level so it can run on a process pool
+def backfill_worker(date, report_list, out_dir, analysis):
+    os.makedirs(out_dir, exist_ok=True)
+    return [getattr(sys.modules[__name__], report)(date, out_dir, analysis, 1) for report in report_list]
+
+# Backfill: rerun the reports as of every date from start to end (freq='ME' is month end)
+# the analyses of all dates are built in one incremental pass, the reports of each date are written to
+# dir/backfill/YYYYMMDD/ and the dates are rendered on jobs processes
+def backfill_runner(start, end, freq, report_config: str, dir: str, jobs=1):
+    from concurrent.futures import ProcessPoolExecutor
+    from Reporting import BackfillUnrateHouse
+    report_list = [report.strip() for report in report_config.split(',')
+                   if report.strip() and report.strip() not in BATCH_REPORTS]
+    dates = BackfillUnrateHouse.backfill_dates(start, end, freq)
+    analyses = BackfillUnrateHouse.build_backfill_analyses(dir, dates, jobs=jobs, rolling=any(
+        report in ROLLING_REPORTS for report in report_list))
+    dates = list(analyses)
+
+    backfill_dir = dir + BackfillUnrateHouse.BACKFILL_DIR
+    os.makedirs(backfill_dir, exist_ok=True)
+    summary_path = (backfill_dir + start.strftime("%Y%m%d") + "_" + end.strftime("%Y%m%d")
+                    + "_unemployment_house_backfill_summary.csv")
+    BackfillUnrateHouse.backfill_summary(analyses).to_csv(summary_path, index=False)
+
+    if report_list:
+        out_dirs = [backfill_dir + as_of.strftime("%Y%m%d") + '/' for as_of in dates]
+        if jobs > 1 and len(dates) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                list(pool.map(backfill_worker, dates, [report_list] * len(dates), out_dirs,
+                              [analyses[as_of] for as_of in dates]))
+        else:
+            for as_of, out_dir in zip(dates, out_dirs):
+                backfill_worker(as_of, report_list, out_dir, analyses[as_of])
+    return summary_path
@@ -0,0 +1,200 @@
+import argparse
+import datetime
+import json
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import reports
+from Reporting import UnrateHouse
+
+# python GenerateReports/server.py -o C:\Users\siaha\PycharmProjects\Unemployment_House\Analytics_Output\\ -p 8000
+# GET  /reports/unratehouse_html?date=2024/12/01   (also unratehouse_html_bundle, unratehouse_pdf, unratehouse_excel)
+# GET  /tables/master | stationary | regression | correlation_grid   (?format=csv for csv instead of json)
+# GET  /reports/correlationplot2.png   figures linked by the html report, written next to it
+# POST /reload   reloads the csv files and drops every cached result
+
+# File name written by each report, the server returns that file
+REPORT_FILES = {
+    'unratehouse_html': ('_unemployment_house_report.html', 'text/html; charset=utf-8'),
+    'unratehouse_html_bundle': ('_unemployment_house_report_bundle.html', 'text/html; charset=utf-8'),
+    'unratehouse_pdf': ('_unemployment_house_report.pdf', 'application/pdf'),
+    'unratehouse_excel': ('_unemployment_house_report.xlsx',
+                          'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'unratehouse_excel_features': ('_unemployment_house_features.xlsx',
+                                   'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+# Tables served from the analysis result
+TABLES = ['master', 'stationary', 'regression', 'correlation_grid']
+# Figures the html report links with relative paths, served from the output directory
+REPORT_IMAGES = ['correlationplot2.png', 'corrmatrix2.png']
+
+
+# Small LRU cache of rendered reports and tables
+class LRUCache:
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+# Warm state of the server: the analysis of the output directory and the cache of rendered results
+class ReportState:
+    def __init__(self, dir, jobs=1, cache_size=32):
+        self.dir = dir
+        self.jobs = jobs
+        self.cache = LRUCache(cache_size)
+        # matplotlib and the report files are not thread safe, reports are rendered one at a time
+        self.render_lock = threading.Lock()
+        self.analysis = UnrateHouse.run_analysis(dir)
+
+    def reload(self):
+        with self.render_lock:
+            UnrateHouse.run_analysis.cache_clear()
+            self.cache.clear()
+            self.analysis = UnrateHouse.run_analysis(self.dir)
+        return len(self.analysis['master'])
+
+    def report(self, report, date):
+        key = ('report', report, date.strftime("%Y%m%d"))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        with self.render_lock:
+            getattr(reports, report)(date, self.dir, self.analysis, self.jobs)
+            with open(self.dir + date.strftime("%Y%m%d") + REPORT_FILES[report][0], 'rb') as file:
+                content = file.read()
+        self.cache.put(key, content)
+        return content
+
+    # Function to read a figure written by the html report, None until a report has rendered it
+    def image(self, name):
+        with self.render_lock:
+            try:
+                with open(self.dir + name, 'rb') as file:
+                    return file.read()
+            except FileNotFoundError:
+                return None
+
+    def table(self, name, format='json'):
+        key = ('table', name, format)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        if name == 'master':
+            df = self.analysis['master'].reset_index()
+        elif name == 'stationary':
+            df = self.analysis['stationary_result']
+        elif name == 'regression':
+            df = self.analysis['regression_result']
+        else:
+            df = self.analysis['correlation_grid']['grid'].reset_index()
+        df = df.rename(columns=str)
+        if format == 'csv':
+            content = df.to_csv(index=False).encode('utf-8')
+        else:
+            content = df.to_json(orient='records', date_format='iso').encode('utf-8')
+        self.cache.put(key, content)
+        return content
+
+
+# Function to create the request handler bound to one server state
+def make_handler(state):
+    class ReportHandler(BaseHTTPRequestHandler):
+        def send_content(self, status, content, content_type):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def send_error_json(self, status, message):
+            self.send_content(status, json.dumps({'error': message}).encode('utf-8'), 'application/json')
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            parts = [part for part in url.path.split('/') if part]
+            try:
+                if len(parts) == 2 and parts[0] == 'reports' and parts[1] in REPORT_FILES:
+                    date_arg = query.get('date', [None])[0]
+                    date = datetime.datetime.strptime(date_arg, "%Y/%m/%d") if date_arg else datetime.datetime.today()
+                    self.send_content(200, state.report(parts[1], date), REPORT_FILES[parts[1]][1])
+                elif len(parts) == 2 and parts[0] == 'reports' and parts[1] in REPORT_IMAGES:
+                    content = state.image(parts[1])
+                    if content is None:
+                        self.send_error_json(404, parts[1] + ' is written by /reports/unratehouse_html')
+                    else:
+                        self.send_content(200, content, 'image/png')
+                elif len(parts) == 2 and parts[0] == 'tables' and parts[1] in TABLES:
+                    format = query.get('format', ['json'])[0]
+                    content_type = 'text/csv' if format == 'csv' else 'application/json'
+                    self.send_content(200, state.table(parts[1], format), content_type)
+                else:
+                    self.send_error_json(404, 'unknown endpoint ' + url.path)
+            except ValueError as error:
+                self.send_error_json(400, str(error))
+            except Exception as error:
+                self.send_error_json(500, repr(error))
+
+        def do_POST(self):
+            try:
+                if urlparse(self.path).path.rstrip('/') == '/reload':
+                    rows = state.reload()
+                    self.send_content(200, json.dumps({'reloaded': True, 'rows': rows}).encode('utf-8'),
+                                      'application/json')
+                else:
+                    self.send_error_json(404, 'unknown endpoint ' + self.path)
+            # A reload failing on the inputs (missing or malformed csv files) is a server side error
+            except Exception as error:
+                self.send_error_json(500, repr(error))
+
+    return ReportHandler
+
+
+# Function to create the server, port 0 picks a free port (useful for local tests)
+def make_server(dir, host='127.0.0.1', port=8000, jobs=1, cache_size=32):
+    state = ReportState(dir, jobs, cache_size)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.state = state
+    return server
+
+
+#function for arguments definition
+def server_arg():
+    parser = argparse.ArgumentParser(description="Serve Reports!")
+    parser.add_argument('-o', "--output", type=str, required=True, help="output directory holding the csv files")
+    parser.add_argument('-p', "--port", type=int, required=False, default=8000, help="port: default 8000")
+    parser.add_argument("--host", type=str, required=False, default='127.0.0.1', help="host: default 127.0.0.1")
+    parser.add_argument('-j', '--jobs', type=int, required=False, default=1,
+                        help="number of processes used to render figures: default 1")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = server_arg()
+    server = make_server(args.output, args.host, args.port, args.jobs)
+    print(f"Serving reports of {args.output} on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
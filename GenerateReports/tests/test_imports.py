@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+import unittest
+
+# Folder holding reports.py, the scripts are run from it
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Libraries only the figures, ADF tests and html report need, importing the report runner must not load them
+HEAVY_MODULES = ['matplotlib', 'plotly', 'statsmodels', 'seaborn']
+
+
+class ImportTest(unittest.TestCase):
+
+    # A fresh interpreter, so modules imported by other tests do not count
+    def test_reports_import_is_lazy(self):
+        code = 'import sys, reports; print([name for name in ' + repr(HEAVY_MODULES) + ' if name in sys.modules])'
+        output = subprocess.run([sys.executable, '-c', code], cwd=PACKAGE_DIR, capture_output=True, text=True,
+                                check=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+
+if __name__ == '__main__':
+    unittest.main()